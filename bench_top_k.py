@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of top-k selection over catalogs of 2k to 200k colors.
+
+For each size, the CIEDE2000 distances of one query are computed once and
+three ways of picking the best `k` are timed on them:
+
+    dict+sort   one result dict per catalog row, list.sort, slice
+    lexsort     full np.lexsort of (code rank, distance)
+    partition   catalog._rank: np.partition + sort of the k (+ ties) kept
+
+followed by the end-to-end LabCatalog.top_k (brute force and KD-tree index).
+Peak KiB is the tracemalloc peak of one call (Python objects and numpy
+buffers). Peak blocks is the most allocator blocks (Python objects, row
+dicts included) live at once during one call above the starting count,
+sampled at every function call and return: per-row dicts make it grow
+with the catalog, array selection keeps it flat. ms is the median of
+--repeat calls.
+
+    python bench_top_k.py --sizes 2000 20000 200000 --k 20
+"""
+
+import argparse
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from catalog import LabCatalog, _rank
+from color_engine import srgb_to_lab
+
+
+def synthetic_catalog(size, seed=11):
+    """LabCatalog of `size` random sRGB colors with shuffled codes."""
+    rng = np.random.default_rng(seed)
+    rgb = rng.integers(0, 256, (size, 3))
+    codes = [f'{i:06d} TCX' for i in rng.permutation(size)]
+    hexes = ['#{:02x}{:02x}{:02x}'.format(*row) for row in rgb.tolist()]
+    return LabCatalog(codes, codes, hexes, srgb_to_lab(rgb / 255.0))
+
+
+def select_dict_sort(catalog, distances, k):
+    rows = [
+        {'code': code, 'hex': hex_value, 'delta_e': distance}
+        for code, hex_value, distance in zip(catalog.codes, catalog.hexes, distances.tolist())
+    ]
+    rows.sort(key=lambda row: (row['delta_e'], row['code']))
+    return rows[:k]
+
+
+def select_lexsort(catalog, distances, k):
+    order = np.lexsort((catalog.code_rank, distances))[:k]
+    return order, distances[order]
+
+
+def select_partition(catalog, distances, k):
+    return _rank(np.arange(len(distances)), distances, k, catalog.code_rank)
+
+
+def peak_blocks(func):
+    """Most allocator blocks live at once during func(), above the count before it."""
+    baseline = peak = sys.getallocatedblocks()
+
+    def probe(frame, event, arg):
+        nonlocal peak
+        peak = max(peak, sys.getallocatedblocks())
+
+    sys.setprofile(probe)
+    try:
+        func()
+    finally:
+        sys.setprofile(None)
+    return peak - baseline
+
+
+def measure(func, repeat):
+    """(median ms, peak KiB, peak blocks) of func()."""
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    blocks = peak_blocks(func)
+
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times), peak / 1024, blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark top-k selection')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 20000, 200000])
+    parser.add_argument('--k', type=int, default=20, help='Results per query (mvp_api caps limit at 20)')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    query = tuple(srgb_to_lab(np.array([0.2, 0.4, 0.6])))
+    print(f"{'rows':>8} {'method':<18} {'ms':>9} {'peak KiB':>10} {'peak blocks':>12}")
+    for size in args.sizes:
+        catalog = synthetic_catalog(size)
+        catalog.code_rank
+        distances = catalog.delta_e(query)
+        reference = [catalog.codes[i] for i in select_partition(catalog, distances, args.k)[0]]
+        assert [row['code'] for row in select_dict_sort(catalog, distances, args.k)] == reference
+
+        runs = {
+            'dict+sort': lambda: select_dict_sort(catalog, distances, args.k),
+            'lexsort': lambda: select_lexsort(catalog, distances, args.k),
+            'partition': lambda: select_partition(catalog, distances, args.k),
+            'top_k brute': lambda: catalog.top_k(query, args.k, brute_force=True),
+            'top_k index': lambda: catalog.top_k(query, args.k, brute_force=False),
+        }
+        catalog.top_k(query, args.k, brute_force=False)  # builds the tree
+        repeat = max(3, args.repeat * 2000 // size)
+        for name, func in runs.items():
+            ms, peak, blocks = measure(func, repeat)
+            print(f"{size:>8} {name:<18} {ms:>9.3f} {peak:>10.1f} {blocks:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Precomputed Lab catalog shared by all matching requests.
+
+A LabCatalog is built once from catalog rows (SQLite or Xano) and holds
+contiguous float64 L, a, b arrays plus parallel code / name / hex arrays,
+so the query path never converts catalog colors between color spaces.
+
+Top-k queries on large catalogs go through a KD-tree over the Lab points:
+candidates are pulled by Euclidean Delta E 76 within a radius that provably
+contains every color at least as close (CIEDE2000) as the k-th best, and
+only those candidates are scored with the exact CIEDE2000 kernel. Results
+are identical to the brute-force scan, which is still used for small
+catalogs and can be forced with SMARTCOLOR_MATCH_BRUTE_FORCE=1.
+"""
+
+import hashlib
+import json
+import math
+import os
+import string
+from functools import cached_property
+
+import numpy as np
+
+from color_engine import delta_e_cie2000_components, hex_to_lab_array
+
+# Catalogs smaller than this are scanned in full (faster than the tree).
+INDEX_MIN_ROWS = int(os.environ.get("SMARTCOLOR_INDEX_MIN_ROWS", "20000"))
+# Forces the full scan everywhere, e.g. to verify index results.
+BRUTE_FORCE = os.environ.get("SMARTCOLOR_MATCH_BRUTE_FORCE", "").strip().lower() in ("1", "true", "yes")
+
+# Lower bound CIEDE2000 >= KAPPA * DeltaE76 / S_max (see safe_radius).
+# The R_T rotation term is at most 2*sin(60°) = sqrt(3) in magnitude, so
+# y^2 + z^2 + R_T*y*z >= (1 - sqrt(3)/2) * (y^2 + z^2).
+_KAPPA = math.sqrt(1.0 - math.sqrt(3.0) / 2.0)
+
+# Query x catalog cells scored at once by top_k_batch. Blocks of this size
+# keep the kernel's temporaries cache-resident; larger blocks are slower.
+_BATCH_CELLS = 65536
+
+
+def is_valid_hex(value):
+    """True for "#RRGGBB" / "RRGGBB" strings."""
+    if not isinstance(value, str):
+        return False
+    value = value.strip().lstrip('#')
+    return len(value) == 6 and all(c in string.hexdigits for c in value)
+
+
+class LabCatalog:
+    """Catalog of colors with their Lab values precomputed as arrays."""
+
+    def __init__(self, codes, names, hexes, lab, records=None):
+        lab = np.asarray(lab, dtype=np.float64).reshape(-1, 3)
+        self.codes = np.array(codes, dtype=object)
+        self.names = np.array(names, dtype=object)
+        self.hexes = np.array(hexes, dtype=object)
+        self.L = np.ascontiguousarray(lab[:, 0])
+        self.a = np.ascontiguousarray(lab[:, 1])
+        self.b = np.ascontiguousarray(lab[:, 2])
+        # Per-row extra data (image metadata, swatch URLs...) kept as-is.
+        self.records = list(records) if records is not None else [{} for _ in range(len(self.L))]
+
+    @classmethod
+    def from_rows(cls, rows, hex_key='hex', code_key='code', name_key='name'):
+        """
+        Builds a catalog from dict-like rows, skipping rows without a valid HEX.
+
+        Each row is kept in `records` so callers can attach their own fields.
+        """
+        kept = []
+        hexes = []
+        for row in rows:
+            hex_value = row[hex_key]
+            if not is_valid_hex(hex_value):
+                continue
+            kept.append(row)
+            hexes.append(hex_value)
+
+        lab = hex_to_lab_array(hexes) if hexes else np.empty((0, 3))
+        return cls(
+            codes=[row[code_key] for row in kept],
+            names=[row[name_key] for row in kept],
+            hexes=hexes,
+            lab=lab,
+            records=kept,
+        )
+
+    @classmethod
+    def from_columns(cls, codes, names, hexes, L, a, b, records=None):
+        """
+        Builds a catalog from separate L, a, b columns.
+
+        Contiguous float64 columns (e.g. memory-mapped from a compiled
+        catalog) are used as-is, without a copy.
+        """
+        catalog = cls(codes, names, hexes, np.empty((0, 3)), records=records if records is not None else [])
+        catalog.L = np.ascontiguousarray(L, dtype=np.float64)
+        catalog.a = np.ascontiguousarray(a, dtype=np.float64)
+        catalog.b = np.ascontiguousarray(b, dtype=np.float64)
+        if records is None:
+            catalog.records = [{} for _ in range(len(catalog.L))]
+        return catalog
+
+    def __len__(self):
+        return len(self.L)
+
+    @cached_property
+    def lab_version(self):
+        """Fingerprint of the colors only (order, code, HEX and Lab), ignoring records."""
+        digest = hashlib.sha1()
+        digest.update(np.column_stack((self.L, self.a, self.b)).tobytes())
+        digest.update('\n'.join(self.hexes).encode('utf-8'))
+        digest.update('\n'.join(map(str, self.codes)).encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    @cached_property
+    def code_rank(self):
+        """
+        Position of each entry in code order (equal codes by index).
+
+        Results tied on distance are ordered by it, so the answer does not
+        depend on the order the rows were loaded in.
+        """
+        order = sorted(range(len(self.codes)), key=lambda i: str(self.codes[i]))
+        rank = np.empty(len(order), dtype=np.intp)
+        rank[order] = np.arange(len(order))
+        return rank
+
+    @cached_property
+    def version(self):
+        """
+        Content fingerprint of the catalog (colors and records).
+
+        Equal for two builds of the same data, so caches keyed on it survive
+        refreshes that change nothing. Computed on first use, after callers
+        have finished filling `records`.
+        """
+        digest = hashlib.sha1()
+        digest.update(np.column_stack((self.L, self.a, self.b)).tobytes())
+        digest.update(json.dumps(
+            [list(self.codes), list(self.names), list(self.hexes), self.records],
+            sort_keys=True, default=str,
+        ).encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    def lab(self, index):
+        """Lab tuple of one catalog entry."""
+        return float(self.L[index]), float(self.a[index]), float(self.b[index])
+
+    def delta_e(self, lab):
+        """CIEDE2000 from one Lab tuple to every catalog entry, shape (N,)."""
+        l, a, b = lab
+        return delta_e_cie2000_components(l, a, b, self.L, self.a, self.b)
+
+    def delta_e_at(self, lab, indices):
+        """CIEDE2000 from one Lab tuple to the given catalog entries."""
+        l, a, b = lab
+        return delta_e_cie2000_components(l, a, b, self.L[indices], self.a[indices], self.b[indices])
+
+    def top_k(self, lab, k, brute_force=None):
+        """
+        The k catalog entries closest to `lab` by CIEDE2000.
+
+        Args:
+            lab: (L, a, b) of the query color
+            k: Number of entries to return
+            brute_force: True scans the whole catalog; None follows BRUTE_FORCE
+                and only uses the index for catalogs of INDEX_MIN_ROWS or more
+
+        Returns:
+            (indices, distances) arrays ordered by distance, ties by code
+        """
+        k = max(0, min(int(k), len(self)))
+        if brute_force is None:
+            brute_force = BRUTE_FORCE or len(self) < INDEX_MIN_ROWS
+        if k == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        if brute_force:
+            return _rank(np.arange(len(self)), self.delta_e(lab), k, self.code_rank)
+        return self._top_k_indexed(lab, k)
+
+    def top_k_batch(self, labs, ks, brute_force=None):
+        """
+        top_k for many queries, scoring the query x catalog matrix in one pass.
+
+        Args:
+            labs: Array-like (Q, 3) of query Lab colors
+            ks: Number of entries to return for each query (length Q)
+            brute_force: Same as in top_k
+
+        Returns:
+            List of (indices, distances) pairs, in query order
+        """
+        labs = np.asarray(labs, dtype=np.float64).reshape(-1, 3)
+        ks = [max(0, min(int(k), len(self))) for k in ks]
+        if brute_force is None:
+            brute_force = BRUTE_FORCE or len(self) < INDEX_MIN_ROWS
+        if not brute_force:
+            return [self.top_k(tuple(lab), k, brute_force=False) for lab, k in zip(labs, ks)]
+
+        all_indices = np.arange(len(self))
+        results = []
+        # Rows per block keep the distance matrix (and its temporaries) bounded.
+        block_rows = max(1, _BATCH_CELLS // max(1, len(self)))
+        for start in range(0, len(labs), block_rows):
+            block = labs[start:start + block_rows]
+            distances = delta_e_cie2000_components(
+                block[:, 0:1], block[:, 1:2], block[:, 2:3], self.L, self.a, self.b,
+            )
+            for row, k in zip(distances, ks[start:start + block_rows]):
+                results.append(_rank(all_indices, row, k, self.code_rank))
+        return results
+
+    def _top_k_indexed(self, lab, k):
+        tree = self._get_tree()
+        point = np.array([lab], dtype=np.float64)
+
+        # Upper bound for the k-th best CIEDE2000 from the nearest points by
+        # Delta E 76 (the true k-th best can only be smaller).
+        seed_count = min(len(self), max(4 * k, 16))
+        _, seed = tree.query(point, k=seed_count)
+        seed = seed[0]
+        kth_best = np.partition(self.delta_e_at(lab, seed), k - 1)[k - 1]
+
+        radius = self._safe_radius(lab, kth_best)
+        candidates = tree.query_radius(point, r=radius)[0]
+        if len(candidates) * 2 >= len(self):
+            return _rank(np.arange(len(self)), self.delta_e(lab), k, self.code_rank)
+        return _rank(candidates, self.delta_e_at(lab, candidates), k, self.code_rank)
+
+    def _safe_radius(self, lab, max_delta_e):
+        """Delta E 76 radius outside of which every entry has CIEDE2000 > max_delta_e."""
+        l, a, b = lab
+        return float(safe_radius(l, a, b, max_delta_e, self._max_chroma, self._max_lightness_span))
+
+    def _get_tree(self):
+        if getattr(self, '_tree', None) is None:
+            from sklearn.neighbors import KDTree
+
+            points = np.column_stack((self.L, self.a, self.b))
+            self._max_chroma = float(np.hypot(self.a, self.b).max())
+            self._max_lightness_span = float(np.abs(self.L - 50.0).max())
+            self._tree = KDTree(points)
+        return self._tree
+
+
+def safe_radius(l, a, b, max_delta_e, max_chroma, max_lightness_span):
+    """
+    Delta E 76 radius around (l, a, b) outside of which every catalog entry
+    has CIEDE2000 > max_delta_e. Broadcasts over array arguments.
+
+    CIEDE2000 >= KAPPA * DeltaE76 / max(S_L, S_C, S_H), because a' only
+    grows a (G >= 0) and dC'^2 + dH'^2 is the (a', b) distance. S_H never
+    exceeds S_C (T <= 1.93), S_L is bounded by the L range, and the mean
+    chroma C'avg <= 0.75 * (C_query + C_entry) is bounded both by the
+    catalog's max chroma and by C_entry <= C_query + DeltaE76.
+
+    Args:
+        max_chroma: Largest chroma in the catalog
+        max_lightness_span: Largest |L - 50| in the catalog
+    """
+    chroma = np.hypot(a, b)
+    lightness_span = np.maximum(np.abs(np.asarray(l, dtype=np.float64) - 50.0), max_lightness_span)
+    s_l = 1.0 + 0.015 * lightness_span ** 2 / np.sqrt(20.0 + lightness_span ** 2)
+
+    d_l = max_delta_e * s_l / _KAPPA
+    d_capped = max_delta_e * (1.0 + 0.045 * 0.75 * (chroma + max_chroma)) / _KAPPA
+    slope = _KAPPA - 0.045 * 0.75 * max_delta_e
+    with np.errstate(divide='ignore'):
+        d_uncapped = np.where(
+            slope > 0, max_delta_e * (1.0 + 0.045 * 1.5 * chroma) / np.where(slope > 0, slope, 1.0), np.inf,
+        )
+
+    radius = np.maximum(d_l, np.minimum(d_capped, d_uncapped))
+    # Headroom for float rounding in the kernel and the tree.
+    return radius * (1.0 + 1e-9) + 1e-9
+
+
+def _rank(indices, distances, k, tiebreak):
+    """
+    Top k of (indices, distances), ordered by distance then tiebreak[index].
+
+    Partial selection: np.partition finds the k-th smallest distance in
+    linear time and only the entries up to it (k plus any ties) are sorted.
+    """
+    if k == 0:
+        return indices[:0], distances[:0]
+    if k < len(distances):
+        kth = np.partition(distances, k - 1)[k - 1]
+        keep = np.flatnonzero(distances <= kth)
+        indices, distances = indices[keep], distances[keep]
+    order = np.lexsort((tiebreak[indices], distances))[:k]
+    return indices[order], distances[order]
+
+
+def rank_rows(distances, k, tiebreak=None):
+    """
+    Row-wise top k of a (Q, N) distance matrix, ordered by distance then
+    tiebreak[column] (the column index if None).
+
+    Uses argpartition for the k + 1 smallest per row; rows where the k-th and
+    (k+1)-th values tie (so an equal entry that ranks first on the tiebreak
+    might have been left out) are re-ranked with _rank.
+
+    Returns:
+        (indices, distances), both (Q, k)
+    """
+    rows, n = distances.shape
+    k = min(k, n)
+    if tiebreak is None:
+        tiebreak = np.arange(n)
+    if k == n:
+        order = np.lexsort((np.broadcast_to(tiebreak, distances.shape), distances), axis=1)
+        return order, np.take_along_axis(distances, order, axis=1)
+
+    part = np.argpartition(distances, k, axis=1)[:, :k + 1]
+    part_distances = np.take_along_axis(distances, part, axis=1)
+    order = np.lexsort((tiebreak[part], part_distances), axis=1)
+    indices = np.take_along_axis(part, order, axis=1)
+    values = np.take_along_axis(part_distances, order, axis=1)
+
+    ties = np.flatnonzero(values[:, k - 1] == values[:, k]) if k else []
+    all_columns = np.arange(n)
+    for row in ties:
+        indices[row, :k], values[row, :k] = _rank(all_columns, distances[row], k, tiebreak)
+    return indices[:, :k], values[:, :k]
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Columnar binary build of pantone_data.json, read through mmap.
+
+The JSON is compiled once into a single file of fixed-width columns:
+
+    code, name, extracted_hex, visual_hex, original_link   string tables
+    rgb (N, 3) uint8, cmyk (N, 4) uint8                     stored values
+    L, a, b                                                 Lab of extracted_hex
+    visual_L, visual_a, visual_b                            Lab of visual_hex (NaN if none)
+
+Lab columns are float64 computed with color_engine (the same conversion
+the matchers use), so catalogs built from them are identical to ones built
+from the HEX values. At build time they are checked against the rounded
+Lab stored in the JSON, and the stored RGB against the HEX; a mismatch
+fails the build.
+
+Layout: 8-byte magic, little-endian uint64 header length, JSON header
+(row count, source hash, column dtype / shape / offset), then every array
+aligned to 64 bytes. Loading maps the file and returns numpy views into
+it, so nothing is parsed or copied up front. A string table is an int64
+offsets array (N + 1) plus one UTF-8 blob.
+
+    python catalog_binary.py docs/pantone_data.json pantone_catalog.bin
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from catalog import is_valid_hex
+from color_engine import hex_to_lab_array, hex_to_rgb_array
+
+DEFAULT_JSON_PATH = os.environ.get("SMARTCOLOR_PANTONE_JSON", os.path.join("docs", "pantone_data.json"))
+DEFAULT_COMPILED_PATH = os.environ.get("SMARTCOLOR_COMPILED_CATALOG", "pantone_catalog.bin")
+
+MAGIC = b"SCCAT\x00\x01\n"
+FORMAT_VERSION = 1
+_ALIGN = 64
+
+# Stored Lab values are rounded to 2 decimals.
+LAB_TOLERANCE = 0.005 + 1e-6
+
+STRING_COLUMNS = ("code", "name", "extracted_hex", "visual_hex", "original_link")
+
+
+def _source_digest(json_path):
+    digest = hashlib.sha256()
+    with open(json_path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _string_table(values):
+    encoded = [(value or "").encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _lab_columns(hexes):
+    """(L, a, b) float64 columns for HEX values, NaN where a value is invalid."""
+    lab = np.full((len(hexes), 3), np.nan)
+    valid = [i for i, value in enumerate(hexes) if is_valid_hex(value)]
+    if valid:
+        lab[valid] = hex_to_lab_array([hexes[i] for i in valid])
+    return [np.ascontiguousarray(lab[:, c]) for c in range(3)]
+
+
+def _validate(entries, L, a, b):
+    """Codes whose stored Lab or RGB disagrees with the extracted_hex."""
+    errors = []
+    for i, entry in enumerate(entries):
+        hex_value = entry.get("extracted_hex")
+        if not is_valid_hex(hex_value or ""):
+            continue
+        stored_lab = entry.get("lab") or {}
+        if stored_lab:
+            computed = (L[i], a[i], b[i])
+            stored = (stored_lab.get("L"), stored_lab.get("a"), stored_lab.get("b"))
+            if any(s is None or abs(c - s) > LAB_TOLERANCE for c, s in zip(computed, stored)):
+                errors.append(f"{entry.get('code')}: stored Lab {stored} != computed "
+                              f"({computed[0]:.3f}, {computed[1]:.3f}, {computed[2]:.3f})")
+        stored_rgb = entry.get("rgb") or {}
+        if stored_rgb:
+            rgb = tuple(int(v) for v in hex_to_rgb_array([hex_value])[0])
+            if rgb != (stored_rgb.get("r"), stored_rgb.get("g"), stored_rgb.get("b")):
+                errors.append(f"{entry.get('code')}: stored RGB {stored_rgb} != {hex_value}")
+    return errors
+
+
+def compile_catalog(json_path=DEFAULT_JSON_PATH, out_path=DEFAULT_COMPILED_PATH):
+    """
+    Compiles pantone_data.json into the binary catalog (written atomically).
+
+    Returns:
+        Number of rows written
+
+    Raises:
+        ValueError: Stored Lab / RGB values disagree with the HEX values
+    """
+    with open(json_path, encoding="utf-8") as fh:
+        entries = [entry for entry in json.load(fh) if isinstance(entry, dict)]
+
+    L, a, b = _lab_columns([entry.get("extracted_hex") or "" for entry in entries])
+    errors = _validate(entries, L, a, b)
+    if errors:
+        shown = "\n  ".join(errors[:20])
+        raise ValueError(f"{len(errors)} catalog entries failed validation:\n  {shown}")
+    visual_L, visual_a, visual_b = _lab_columns([entry.get("visual_hex") or "" for entry in entries])
+
+    def channels(entry, key, names):
+        values = entry.get(key) or {}
+        return [int(values.get(name) or 0) for name in names]
+
+    arrays = {
+        "rgb": np.array([channels(e, "rgb", "rgb") for e in entries], dtype=np.uint8).reshape(-1, 3),
+        "cmyk": np.array([channels(e, "cmyk", "cmyk") for e in entries], dtype=np.uint8).reshape(-1, 4),
+        "L": L, "a": a, "b": b,
+        "visual_L": visual_L, "visual_a": visual_a, "visual_b": visual_b,
+    }
+    for column in STRING_COLUMNS:
+        offsets, data = _string_table([entry.get(column) for entry in entries])
+        arrays[f"{column}.offsets"] = offsets
+        arrays[f"{column}.data"] = data
+
+    columns = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // _ALIGN) * _ALIGN
+        columns[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+    header = json.dumps({
+        "format": FORMAT_VERSION,
+        "rows": len(entries),
+        "source_sha256": _source_digest(json_path),
+        "columns": columns,
+    }).encode("utf-8")
+    data_start = -(-(len(MAGIC) + 8 + len(header)) // _ALIGN) * _ALIGN
+
+    directory = os.path.dirname(os.path.abspath(out_path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(MAGIC)
+            fh.write(len(header).to_bytes(8, "little"))
+            fh.write(header)
+            for name, array in arrays.items():
+                fh.seek(data_start + columns[name]["offset"])
+                fh.write(np.ascontiguousarray(array).tobytes())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(entries)
+
+
+class StringColumn:
+    """Read-only view of a string table; values decode on access."""
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return bytes(self.data[start:end]).decode("utf-8")
+
+    def tolist(self):
+        blob = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        return [blob[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+
+class CompiledCatalog:
+    """A memory-mapped binary catalog."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fh:
+            if fh.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a compiled catalog")
+            header_length = int.from_bytes(fh.read(8), "little")
+            header = json.loads(fh.read(header_length))
+        if header.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported format {header.get('format')}")
+        self.header = header
+        self.rows = header["rows"]
+        self.source_sha256 = header["source_sha256"]
+
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        data_start = -(-(len(MAGIC) + 8 + header_length) // _ALIGN) * _ALIGN
+        self._arrays = {}
+        for name, spec in header["columns"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"], dtype=np.int64))
+            start = data_start + spec["offset"]
+            view = buffer[start:start + count * dtype.itemsize].view(dtype)
+            self._arrays[name] = view.reshape(spec["shape"])
+
+    def array(self, name):
+        return self._arrays[name]
+
+    def strings(self, name):
+        return StringColumn(self._arrays[f"{name}.offsets"], self._arrays[f"{name}.data"])
+
+    def lab_columns(self, hex_column="extracted_hex"):
+        """(L, a, b) memory-mapped columns for extracted_hex or visual_hex."""
+        prefix = "" if hex_column == "extracted_hex" else "visual_"
+        return tuple(self._arrays[f"{prefix}{channel}"] for channel in ("L", "a", "b"))
+
+
+def is_current(compiled_path, json_path):
+    """True if the compiled file exists and was built from this JSON."""
+    try:
+        return CompiledCatalog(compiled_path).source_sha256 == _source_digest(json_path)
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def load_compiled(json_path=DEFAULT_JSON_PATH, compiled_path=DEFAULT_COMPILED_PATH):
+    """
+    The compiled catalog for json_path, (re)building it if it is missing or
+    was built from a different JSON. None if neither file is usable.
+    """
+    if os.path.exists(json_path) and not is_current(compiled_path, json_path):
+        try:
+            compile_catalog(json_path, compiled_path)
+        except (OSError, ValueError) as exc:
+            print(f"Warning: could not compile {json_path}: {exc}")
+            return None
+    try:
+        return CompiledCatalog(compiled_path)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile pantone_data.json into the binary catalog")
+    parser.add_argument("json_path", nargs="?", default=DEFAULT_JSON_PATH)
+    parser.add_argument("out_path", nargs="?", default=DEFAULT_COMPILED_PATH)
+    args = parser.parse_args()
+
+    rows = compile_catalog(args.json_path, args.out_path)
+    print(f"Wrote {rows} rows to {args.out_path} ({os.path.getsize(args.out_path) / 1024:.0f} KB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+On-disk snapshot of the last good match catalog.
+
+mvp_api writes the catalog rows and their precomputed Lab values after
+every refresh that changed them, and loads the snapshot at boot, so a new
+instance answers its first request from the snapshot (a few milliseconds)
+while the background refresher checks the source.
+
+The file is an uncompressed .npz: a float64 (N, 3) Lab array, fixed-width
+unicode arrays for code / name / hex / swatch_url, and a JSON metadata
+string (source, save time, Xano sync state). Nothing is pickled.
+"""
+
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from catalog import LabCatalog
+
+SNAPSHOT_FORMAT = 1
+
+
+def save_snapshot(path, catalog, source, sync_state=None):
+    """
+    Atomically writes `catalog` (built from mvp_api catalog rows) to `path`.
+
+    Args:
+        catalog: LabCatalog whose records are the catalog rows
+        source: Catalog source the rows came from ("xano", "sqlite")
+        sync_state: JSON-serializable incremental sync state to restore
+    """
+    rows = catalog.records
+    meta = {
+        "format": SNAPSHOT_FORMAT,
+        "source": source,
+        "saved_at": time.time(),
+        "sync_state": sync_state,
+    }
+    arrays = {
+        "lab": np.column_stack((catalog.L, catalog.a, catalog.b)),
+        "code": np.array([row["code"] for row in rows], dtype=str),
+        "name": np.array([row["name"] for row in rows], dtype=str),
+        "hex": np.array([row["hex"] for row in rows], dtype=str),
+        "swatch_url": np.array([row.get("swatch_url") or "" for row in rows], dtype=str),
+        "meta": np.array(json.dumps(meta)),
+    }
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            np.savez(fh, **arrays)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_snapshot(path):
+    """
+    Reads a snapshot written by save_snapshot.
+
+    Returns:
+        (catalog, colors, meta), or None if the file is missing, unreadable
+        or in another format
+    """
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("format") != SNAPSHOT_FORMAT:
+                return None
+            lab = data["lab"]
+            codes, names, hexes = data["code"].tolist(), data["name"].tolist(), data["hex"].tolist()
+            swatch_urls = data["swatch_url"].tolist()
+    except (OSError, KeyError, ValueError):
+        return None
+
+    colors = [
+        {"code": code, "name": name, "hex": hex_value, "swatch_url": swatch_url or None}
+        for code, name, hex_value, swatch_url in zip(codes, names, hexes, swatch_urls)
+    ]
+    catalog = LabCatalog(codes, names, hexes, lab, records=colors)
+    return catalog, colors, meta
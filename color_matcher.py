@@ -3,11 +3,12 @@
 Smart Color Matcher - Encontra cores Pantone mais similares usando Delta E (CIE2000)
 """
 
+import os
 import sqlite3
+import threading
+import time
+from collections import namedtuple
 import numpy as np
-from PIL import Image
-from io import BytesIO
-from sklearn.cluster import KMeans
 
 # Fix para numpy.asscalar
 if not hasattr(np, 'asscalar'):
@@ -15,16 +16,132 @@ if not hasattr(np, 'asscalar'):
         return np.asarray(a).item()
     np.asscalar = asscalar
 
-from colormath.color_objects import sRGBColor, LabColor
-from colormath.color_conversions import convert_color
-from colormath.color_diff import delta_e_cie2000
 from exemplo_uso_banco import PantoneDB
+from catalog import LabCatalog, is_valid_hex
+from color_engine import hex_to_lab_array
+from db_pool import ConnectionPool
+from result_cache import LRUCache
+from extraction_cache import ExtractionCache, cache_key, upload_digest
+from swatch_images import image_version
+from rgb_lut import RGBLookupTable, lut_status
+from image_pipeline import (
+    extraction_pixels, filter_background_pixels, dominant_rgb,
+    WHITE_THRESHOLD, BLACK_THRESHOLD, DEFAULT_EXTRACTOR, EXTRACTORS
+)
+
+HEX_COLUMNS = ('extracted_hex', 'visual_hex')
 
 DB_NAME = 'pantone_database.db'
 
-def extract_dominant_color_from_image(image_file, n_clusters=3, fabric_mode=False):
+# Consultas fixas (o texto constante permite reaproveitar o statement
+# preparado em cada conexão do pool)
+CATALOG_QUERIES = {
+    column: f'''
+        SELECT code, name, {column} as hex_color, visual_hex, extracted_hex,
+               image_path, image_saved, image_width, image_height,
+               file_size_kb, original_link
+        FROM pantone_colors
+        WHERE {column} IS NOT NULL AND {column} != '' AND image_saved = 1
+    '''
+    for column in HEX_COLUMNS
+}
+SELECT_ALL_COLORS = 'SELECT * FROM pantone_colors'
+
+# Pasta local com as imagens das amostras
+IMAGES_DIR = 'pantone_images'
+
+# Campos de cada resultado de busca; fields= escolhe um subconjunto
+MATCH_FIELDS = (
+    'code', 'name', 'hex', 'visual_hex', 'extracted_hex', 'image_path', 'image_saved',
+    'image_width', 'image_height', 'file_size_kb', 'original_link', 'image_url',
+    'lab', 'cmyk', 'rgb', 'delta_e', 'similarity',
+)
+
+# Intervalo mínimo (segundos) entre verificações de mudança no banco
+CATALOG_CHECK_SECONDS = float(os.environ.get('SMARTCOLOR_CATALOG_CHECK_SECONDS', '2'))
+
+# Intervalo (segundos) entre verificações da pasta de imagens em segundo
+# plano; 0 desativa
+IMAGES_CHECK_SECONDS = float(os.environ.get('SMARTCOLOR_IMAGES_CHECK_SECONDS', '10'))
+
+# Máximo de resultados por item em find_similar_colors_batch (como no mvp_api)
+MAX_BATCH_LIMIT = 20
+
+def normalize_code(code):
+    """Código Pantone sem espaços e em minúsculas ("19-1664 TCX" -> "19-1664tcx")"""
+    return ''.join(str(code).split()).lower()
+
+def resolve_image_path(image_path):
+    """
+    Caminho absoluto da imagem de uma cor, ou None se o arquivo não existe.
+    
+    Tenta o caminho gravado no banco e, em seguida, o mesmo nome de arquivo
+    dentro de IMAGES_DIR.
+    """
+    if not image_path:
+        return None
+    for path in (image_path, os.path.join(IMAGES_DIR, os.path.basename(image_path))):
+        if os.path.exists(path):
+            return os.path.abspath(path)
+    return None
+
+def with_image_fields(color):
+    """
+    Cópia da cor com image_path resolvido (caminho absoluto, quando o
+    arquivo existe) e image_url apontando para /api/image/<code> (ou None).
+    
+    A URL leva ?v=<versão do arquivo>, então pode ficar em cache como imutável.
+    """
+    color = dict(color)
+    image_file = resolve_image_path(color.get('image_path'))
+    color['image_url'] = None
+    if image_file:
+        color['image_path'] = image_file
+        try:
+            color['image_url'] = f"/api/image/{color['code']}?v={image_version(image_file)}"
+        except OSError:
+            pass
+    return color
+
+def project_matches(matches, fields=None):
     """
-    Extrai a cor dominante de uma imagem usando K-Means.
+    Cópias dos resultados com só os campos pedidos (todos se fields=None).
+    
+    Quem chama pode alterar os dicionários devolvidos sem afetar o cache.
+    """
+    if fields is None:
+        return [dict(match) for match in matches]
+    return [{field: match.get(field) for field in fields} for match in matches]
+
+def parse_fields(value):
+    """
+    Lista de campos de fields= ("code,hex,delta_e" ou lista); None se vazio.
+    
+    Raises:
+        ValueError: Campo fora de MATCH_FIELDS
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    fields = [str(field).strip() for field in value if str(field).strip()]
+    unknown = [field for field in fields if field not in MATCH_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(MATCH_FIELDS)}")
+    return fields or None
+
+def _images_dir_signature():
+    try:
+        stat = os.stat(IMAGES_DIR)
+        return (stat.st_ino, stat.st_mtime_ns)
+    except OSError:
+        return None
+
+def extract_dominant_color_from_image(image_file, n_clusters=3, fabric_mode=False,
+                                      white_threshold=WHITE_THRESHOLD, black_threshold=BLACK_THRESHOLD,
+                                      extractor=DEFAULT_EXTRACTOR, roi=None, mask=None):
+    """
+    Extrai a cor dominante de uma imagem usando K-Means (ou outro extrator).
     
     Esta função processa a imagem considerando texturas e sombras,
     extraindo a cor visualmente perceptível (cor "suja" com trama).
@@ -33,71 +150,39 @@ def extract_dominant_color_from_image(image_file, n_clusters=3, fabric_mode=Fals
         image_file: Arquivo de imagem (BytesIO, file object ou caminho)
         n_clusters: Número de clusters para K-Means (1 para cor única, 3 para dominante)
         fabric_mode: Se True, aplica compensação para tecidos (escurece 12%)
+        white_threshold: Pixels com R, G e B acima deste valor são tratados como fundo
+        black_threshold: Pixels com R, G e B abaixo deste valor são tratados como sombra
+        extractor: Backend de agrupamento (kmeans, minibatch ou histogram),
+                   ver image_pipeline.EXTRACTORS
+        roi: Região (image_pipeline.parse_roi) de onde extrair; None = imagem inteira
+        mask: Bytes de uma imagem máscara (alfa ou luminância); None = sem máscara
     
     Returns:
         HEX da cor dominante (string) ou None em caso de erro
+    
+    Raises:
+        ValueError: Extrator desconhecido
     """
+    if extractor not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor: {extractor}")
+    
     try:
-        # Abre a imagem
-        if isinstance(image_file, (BytesIO, bytes)):
-            img = Image.open(image_file).convert('RGB')
-        elif isinstance(image_file, str):
-            img = Image.open(image_file).convert('RGB')
-        else:
-            img = Image.open(image_file).convert('RGB')
-        
-        # Redimensiona para 100x100px para performance
-        try:
-            # Pillow >= 10.0
-            img = img.resize((100, 100), Image.Resampling.LANCZOS)
-        except AttributeError:
-            # Pillow < 10.0
-            img = img.resize((100, 100), Image.LANCZOS)
-        
-        # Converte para array numpy
-        img_array = np.array(img)
-        pixels = img_array.reshape(-1, 3)
-        
-        # Filtra pixels brancos e transparentes (fundo)
-        # Remove pixels muito claros (R, G, B > 240) e muito escuros (R, G, B < 10)
-        # Isso ajuda a ignorar fundos brancos e sombras muito escuras
-        filtered_pixels = []
-        for pixel in pixels:
-            r, g, b = pixel
-            # Ignora pixels totalmente brancos (R, G, B > 240)
-            if r > 240 and g > 240 and b > 240:
-                continue
-            # Ignora pixels muito escuros (todos < 10) - provavelmente sombra
-            if r < 10 and g < 10 and b < 10:
-                continue
-            filtered_pixels.append(pixel)
+        # Abre a imagem (ou só a região pedida) e redimensiona para 100x100px
+        # para performance
+        pixels = extraction_pixels(image_file, roi=roi, mask=mask)
         
-        if len(filtered_pixels) == 0:
-            # Se todos os pixels foram filtrados, usa todos
-            filtered_pixels = pixels.tolist()
-        
-        filtered_pixels = np.array(filtered_pixels)
+        # Filtra pixels brancos e transparentes (fundo) e sombras muito escuras
+        # Se todos os pixels forem filtrados, usa todos
+        filtered_pixels = filter_background_pixels(
+            pixels, white_threshold=white_threshold, black_threshold=black_threshold
+        )
         
         if len(filtered_pixels) == 0:
             return None
         
-        # Usa K-Means para encontrar cor dominante
+        # Agrupa os pixels e pega o cluster mais frequente (cor dominante)
         # Se n_clusters=1, retorna a cor média
-        # Se n_clusters=3, pega o cluster mais frequente
-        kmeans = KMeans(n_clusters=min(n_clusters, len(filtered_pixels)), 
-                       random_state=42, n_init=10)
-        kmeans.fit(filtered_pixels)
-        
-        # Pega o cluster mais frequente (cor dominante)
-        labels = kmeans.labels_
-        unique_labels, counts = np.unique(labels, return_counts=True)
-        dominant_cluster_idx = unique_labels[np.argmax(counts)]
-        dominant_color = kmeans.cluster_centers_[dominant_cluster_idx]
-        
-        # Converte para inteiros e garante valores válidos (0-255)
-        r = int(np.clip(dominant_color[0], 0, 255))
-        g = int(np.clip(dominant_color[1], 0, 255))
-        b = int(np.clip(dominant_color[2], 0, 255))
+        r, g, b = dominant_rgb(filtered_pixels, n_clusters=n_clusters, extractor=extractor)
         
         # Converte para HEX
         hex_color = f"#{r:02x}{g:02x}{b:02x}"
@@ -148,11 +233,201 @@ def extract_dominant_color_from_image(image_file, n_clusters=3, fabric_mode=Fals
         traceback.print_exc()
         return None
 
+# Estado publicado de uma vez a cada recarga: catálogo LAB e tabela RGB de
+# cada coluna HEX e o mapa código -> cor. Cada busca lê self.state uma vez,
+# então nunca combina a tabela de uma versão com o catálogo de outra.
+CatalogState = namedtuple('CatalogState', 'catalogs luts lut_status colors_by_code')
+
 class ColorMatcher:
     """Classe para encontrar cores Pantone similares usando Delta E"""
     
-    def __init__(self):
+    def __init__(self, extraction_pool=None):
         self.db = PantoneDB()
+        # Pool de processos opcional para a extração de cor das imagens
+        # (extraction_pool.ExtractionPool); sem pool, roda na própria thread
+        self.extraction_pool = extraction_pool
+        # Cache LRU dos resultados de busca por HEX
+        self.result_cache = LRUCache()
+        # Cores extraídas por conteúdo do upload (+ parâmetros de extração)
+        self.extraction_cache = ExtractionCache()
+        # Conexões SQLite somente leitura reaproveitadas entre requisições
+        self.pool = ConnectionPool(self.db_path)
+        self._catalog_lock = threading.Lock()
+        self._next_catalog_check = 0.0
+        self._catalog_signature = None
+        # catalogs: coluna HEX -> LabCatalog
+        # luts: tabelas RGB -> top-k pré-calculadas (rgb_lut.py), quando existirem
+        # lut_status: current, stale (precisa de python rgb_lut.py) ou missing
+        # colors_by_code: código normalizado -> cor (caminho da imagem já resolvido)
+        self.state = CatalogState({}, {}, {}, {})
+        self._images_signature = None
+        self.refresh_catalogs(force=True)
+        
+        # Revarre a pasta de imagens em segundo plano, fora das requisições
+        if IMAGES_CHECK_SECONDS > 0:
+            threading.Thread(target=self._watch_images, name='image-rescan', daemon=True).start()
+    
+    @property
+    def catalogs(self):
+        return self.state.catalogs
+    
+    @property
+    def luts(self):
+        return self.state.luts
+    
+    @property
+    def lut_status(self):
+        return self.state.lut_status
+    
+    @property
+    def colors_by_code(self):
+        return self.state.colors_by_code
+    
+    @property
+    def db_path(self):
+        """Caminho do arquivo SQLite usado pelo PantoneDB"""
+        return getattr(self.db, 'db_path', DB_NAME)
+    
+    def _database_signature(self):
+        """Inode, tamanho e data de modificação do banco (e do WAL), para detectar mudanças"""
+        signature = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+    
+    def refresh_catalogs(self, force=False):
+        """
+        Recarrega os catálogos LAB se o banco SQLite mudou.
+        
+        A verificação (um os.stat) roda no máximo a cada CATALOG_CHECK_SECONDS.
+        Quando o catálogo muda de versão, o cache de resultados é limpo.
+        
+        Returns:
+            True se os catálogos foram recarregados
+        """
+        now = time.monotonic()
+        if not force and now < self._next_catalog_check:
+            return False
+        
+        with self._catalog_lock:
+            self._next_catalog_check = now + CATALOG_CHECK_SECONDS
+            signature = self._database_signature()
+            if not force and signature == self._catalog_signature:
+                return False
+            
+            # Arquivo substituído (novo inode): as conexões abertas ainda
+            # apontam para o arquivo antigo
+            previous = self._catalog_signature
+            if previous and (previous[0] and previous[0][0]) != (signature[0] and signature[0][0]):
+                self.pool.reset()
+            
+            # Catálogos LAB pré-calculados, um por coluna HEX, compartilhados
+            # por todas as buscas; montados à parte e publicados juntos
+            old_versions = {column: catalog.version for column, catalog in self.catalogs.items()}
+            self._images_signature = _images_dir_signature()
+            catalogs = {column: self._load_catalog(column) for column in HEX_COLUMNS}
+            # Só usa tabelas geradas para este mesmo catálogo
+            luts = {
+                column: RGBLookupTable.load(catalog, column)
+                for column, catalog in catalogs.items() if len(catalog)
+            }
+            statuses = {
+                column: lut_status(catalog, column)
+                for column, catalog in catalogs.items() if len(catalog)
+            }
+            self.state = CatalogState(catalogs, luts, statuses, self._load_colors_by_code())
+            self._catalog_signature = signature
+            
+            if old_versions != {column: catalog.version for column, catalog in catalogs.items()}:
+                self.result_cache.clear()
+            return True
+    
+    def refresh_image_paths(self, force=False):
+        """
+        Resolve de novo os caminhos das imagens se a pasta IMAGES_DIR mudou
+        (arquivos adicionados, removidos ou renomeados).
+        
+        Returns:
+            True se os caminhos foram atualizados
+        """
+        signature = _images_dir_signature()
+        if not force and signature == self._images_signature:
+            return False
+        
+        with self._catalog_lock:
+            self._images_signature = signature
+            state = self.state
+            for catalog in state.catalogs.values():
+                catalog.records = [with_image_fields(record) for record in catalog.records]
+            self.state = state._replace(colors_by_code={
+                code: with_image_fields(color) for code, color in state.colors_by_code.items()
+            })
+            # Resultados em cache têm os caminhos antigos
+            self.result_cache.clear()
+        return True
+    
+    def _watch_images(self):
+        while True:
+            time.sleep(IMAGES_CHECK_SECONDS)
+            try:
+                self.refresh_image_paths()
+            except Exception as e:
+                print(f"Warning: image rescan failed: {e}")
+    
+    def _load_colors_by_code(self):
+        """
+        Carrega todas as cores do banco, indexadas pelo código normalizado.
+        
+        O image_path de cada cor vira o caminho absoluto do arquivo quando
+        ele existe, e image_url aponta para /api/image/<code> (ou None).
+        """
+        colors = {}
+        with self.pool.connection() as conn:
+            rows = conn.execute(SELECT_ALL_COLORS).fetchall()
+        for row in rows:
+            colors.setdefault(normalize_code(row['code']), with_image_fields(row))
+        return colors
+    
+    def _load_catalog(self, hex_column):
+        """
+        Carrega as cores do banco com os campos fixos de cada resultado.
+        
+        LAB, RGB e CMYK dos resultados são montados só para as cores
+        selecionadas (_build_matches), não para o catálogo inteiro.
+        
+        Args:
+            hex_column: Coluna HEX usada na comparação (extracted_hex ou visual_hex)
+        
+        Returns:
+            LabCatalog com um registro (dicionário) por cor
+        """
+        with self.pool.connection() as conn:
+            rows = [dict(row) for row in conn.execute(CATALOG_QUERIES[hex_column])]
+        
+        catalog = LabCatalog.from_rows(rows, hex_key='hex_color')
+        
+        # Campos fixos de cada resultado, calculados uma única vez (inclusive
+        # o caminho da imagem, para as buscas não tocarem no disco)
+        for i, row in enumerate(catalog.records):
+            catalog.records[i] = with_image_fields({
+                'code': row['code'],
+                'name': row['name'],
+                'hex': row['hex_color'],
+                'visual_hex': row.get('visual_hex'),
+                'extracted_hex': row.get('extracted_hex'),
+                'image_path': row['image_path'],
+                'image_saved': bool(row['image_saved']),
+                'image_width': row['image_width'] if row['image_width'] else None,
+                'image_height': row['image_height'] if row['image_height'] else None,
+                'file_size_kb': row.get('file_size_kb'),
+                'original_link': row.get('original_link'),
+            })
+        
+        return catalog
     
     def hex_to_rgb(self, hex_color):
         """Converte HEX para RGB"""
@@ -201,6 +476,10 @@ class ColorMatcher:
             g = int(hex_color[2:4], 16)
             b = int(hex_color[4:6], 16)
             
+            # colormath só é importado aqui (a busca usa color_engine)
+            from colormath.color_objects import sRGBColor, LabColor
+            from colormath.color_conversions import convert_color
+            
             # Cria objeto sRGBColor
             rgb = sRGBColor(r, g, b, is_upscaled=True)
             
@@ -214,7 +493,7 @@ class ColorMatcher:
             traceback.print_exc()
             return None
     
-    def find_similar_colors(self, hex_input, limit=5, use_extracted=True, lightness_boost=1.0):
+    def find_similar_colors(self, hex_input, limit=5, use_extracted=True, lightness_boost=1.0, fields=None):
         """
         Encontra cores Pantone mais similares a uma cor HEX.
         
@@ -224,54 +503,133 @@ class ColorMatcher:
             use_extracted: Se True, usa extracted_hex; senão, usa visual_hex
             lightness_boost: Fator de ganho de luminosidade (ex: 1.05 = 5% mais claro)
                            Feature "Fator Rafaela" - ajusta para aproximar da realidade física
+            fields: Campos de MATCH_FIELDS a incluir em cada resultado (None = todos)
         
         Returns:
             Lista de dicionários com informações das cores mais similares
         """
-        # Converte cor de entrada para LAB
-        lab_input = self.hex_to_lab(hex_input)
-        if not lab_input:
+        if not is_valid_hex(hex_input):
             return []
         
+        # Escolhe qual catálogo usar para comparação
+        self.refresh_catalogs()
+        hex_column = 'extracted_hex' if use_extracted else 'visual_hex'
+        # Catálogo e tabela RGB da mesma recarga
+        state = self.state
+        catalog = state.catalogs[hex_column]
+        
+        # Resultados já calculados para os mesmos parâmetros e versão do catálogo
+        result_key = (
+            hex_input.strip().lstrip('#').lower(), int(limit), hex_column,
+            float(lightness_boost), catalog.version
+        )
+        cached = self.result_cache.get(result_key)
+        if cached is not None:
+            return project_matches(cached, fields)
+        
+        # Sem ajuste de luminosidade, a tabela RGB pré-calculada já tem a resposta
+        lut = state.luts.get(hex_column)
+        if lut is not None and lightness_boost == 1.0:
+            found = lut.lookup(hex_input, int(limit))
+            if found is not None:
+                matches = self._build_matches(catalog, *found)
+                self.result_cache.put(result_key, matches)
+                return project_matches(matches, fields)
+        
+        # Converte cor de entrada para LAB (color_engine, mesma conversão do
+        # colormath sem importá-lo)
+        L, a, b = hex_to_lab_array([hex_input])[0]
+        
         # Aplica lightness_boost (Feature "Fator Rafaela")
         # O físico tende a ser um pouco mais claro que a textura digital escura
         if lightness_boost != 1.0:
-            lab_input.lab_l = min(100, lab_input.lab_l * lightness_boost)
+            L = min(100, L * lightness_boost)
         
-        # Busca todas as cores do banco
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
+        if not len(catalog):
+            return []
         
-        # Escolhe qual coluna usar para comparação
-        hex_column = 'extracted_hex' if use_extracted else 'visual_hex'
+        # Calcula Delta E (distância visual) e seleciona as N mais próximas
+        indices, deltas = catalog.top_k((L, a, b), limit)
+        
+        # Já vem ordenado por Delta E (menor = mais similar)
+        matches = self._build_matches(catalog, indices, deltas)
+        self.result_cache.put(result_key, matches)
+        return project_matches(matches, fields)
+    
+    def find_similar_colors_batch(self, items, limit=5, use_extracted=True, lightness_boost=1.0):
+        """
+        Encontra cores Pantone similares para várias cores HEX de uma vez.
         
-        cursor.execute(f'''
-            SELECT code, name, {hex_column} as hex_color, visual_hex, extracted_hex,
-                   image_path, image_saved, image_width, image_height, 
-                   file_size_kb, original_link
-            FROM pantone_colors
-            WHERE {hex_column} IS NOT NULL AND {hex_column} != '' AND image_saved = 1
-        ''')
+        Todas as cores são comparadas com o catálogo em uma única passada
+        vetorizada (matriz consultas x catálogo). Cada item é validado à
+        parte: um item inválido recebe 'error' sem afetar os demais.
         
-        results = cursor.fetchall()
-        conn.close()
+        Args:
+            items: Lista de HEX (ex: "#bd2c27") ou de dicionários com 'hex' e,
+                   opcionalmente, 'limit' e 'lightness_boost' do item
+            limit: Número de resultados por item, se o item não definir
+                   (limitado a 1..MAX_BATCH_LIMIT)
+            use_extracted: Se True, usa extracted_hex; senão, usa visual_hex
+            lightness_boost: Fator de luminosidade padrão dos itens
         
-        # Calcula Delta E para cada cor
-        matches = []
+        Returns:
+            Lista com um dicionário por item, na ordem de entrada:
+                - input_hex, limit, lightness_boost e results; ou
+                - input_hex, error e results vazio (HEX, limit ou
+                  lightness_boost inválido)
+        """
+        self.refresh_catalogs()
+        catalog = self.catalogs['extracted_hex' if use_extracted else 'visual_hex']
         
-        for row in results:
-            hex_db = row['hex_color']
-            if not hex_db:
+        entries = []
+        for item in items:
+            if not isinstance(item, dict):
+                item = {'hex': item}
+            entry = {'input_hex': item.get('hex'), 'results': []}
+            entries.append(entry)
+            if not is_valid_hex(item.get('hex')):
+                entry['error'] = 'Invalid HEX.'
                 continue
-            
-            # Converte cor do banco para LAB
-            lab_db = self.hex_to_lab(hex_db)
-            if not lab_db:
+            try:
+                item_limit = max(1, min(int(item.get('limit', limit)), MAX_BATCH_LIMIT))
+            except (TypeError, ValueError):
+                entry['error'] = 'Invalid limit.'
                 continue
-            
-            # Calcula Delta E (distância visual)
-            delta_e = delta_e_cie2000(lab_input, lab_db)
-            
+            try:
+                item_boost = float(item.get('lightness_boost', lightness_boost))
+            except (TypeError, ValueError):
+                item_boost = None
+            if item_boost is None or not np.isfinite(item_boost):
+                entry['error'] = 'Invalid lightness_boost.'
+                continue
+            entry['limit'] = item_limit
+            entry['lightness_boost'] = item_boost
+        
+        valid = [entry for entry in entries if 'error' not in entry]
+        if not valid or not len(catalog):
+            return entries
+        
+        # Converte todas as entradas para LAB e aplica o lightness_boost de cada uma
+        labs = hex_to_lab_array([entry['input_hex'] for entry in valid])
+        boosts = np.array([entry['lightness_boost'] for entry in valid])
+        labs[:, 0] = np.where(boosts != 1.0, np.minimum(100, labs[:, 0] * boosts), labs[:, 0])
+        
+        top = catalog.top_k_batch(labs, [entry['limit'] for entry in valid])
+        for entry, (indices, deltas) in zip(valid, top):
+            entry['results'] = self._build_matches(catalog, indices, deltas)
+        
+        return entries
+    
+    def _build_matches(self, catalog, indices, deltas):
+        """
+        Monta os dicionários de resultado para as cores selecionadas.
+        
+        LAB, RGB e CMYK são calculados aqui, só para as `limit` cores
+        escolhidas, e não no carregamento do catálogo.
+        """
+        matches = []
+        
+        for index, delta_e in zip(indices.tolist(), deltas.tolist()):
             # Calcula similaridade percentual (aproximado)
             # Delta E < 1 = imperceptível
             # Delta E < 3 = muito similar
@@ -279,70 +637,82 @@ class ColorMatcher:
             # Delta E > 6 = perceptível diferença
             similarity = max(0, 100 - (delta_e * 5))  # Aproximação
             
-            # Calcula LAB e CMYK para a cor extraída
-            lab_color = self.hex_to_lab(hex_db)
-            rgb_color = self.hex_to_rgb(hex_db)
-            cmyk_color = self.rgb_to_cmyk(rgb_color) if rgb_color else None
-            
-            # Acessa colunas (sqlite3.Row não tem .get())
-            visual_hex = row['visual_hex'] if 'visual_hex' in row.keys() else None
-            extracted_hex = row['extracted_hex'] if 'extracted_hex' in row.keys() else None
-            file_size_kb = row['file_size_kb'] if 'file_size_kb' in row.keys() else None
-            original_link = row['original_link'] if 'original_link' in row.keys() else None
-            
-            matches.append({
-                'code': row['code'],
-                'name': row['name'],
-                'hex': hex_db,
-                'visual_hex': visual_hex,
-                'extracted_hex': extracted_hex,
-                'delta_e': round(delta_e, 2),
-                'similarity': round(similarity, 1),
-                'image_path': row['image_path'],
-                'image_saved': bool(row['image_saved']),
-                'image_width': row['image_width'] if row['image_width'] else None,
-                'image_height': row['image_height'] if row['image_height'] else None,
-                'file_size_kb': file_size_kb,
-                'original_link': original_link,
-                'lab': {
-                    'L': round(lab_color.lab_l, 2) if lab_color else None,
-                    'a': round(lab_color.lab_a, 2) if lab_color else None,
-                    'b': round(lab_color.lab_b, 2) if lab_color else None
-                } if lab_color else None,
-                'cmyk': cmyk_color,
-                'rgb': rgb_color
-            })
+            match = dict(catalog.records[index])
+            L, a, b = catalog.lab(index)
+            rgb_color = self.hex_to_rgb(match['hex'])
+            match['lab'] = {'L': round(L, 2), 'a': round(a, 2), 'b': round(b, 2)}
+            match['cmyk'] = self.rgb_to_cmyk(rgb_color) if rgb_color else None
+            match['rgb'] = rgb_color
+            match['delta_e'] = round(delta_e, 2)
+            match['similarity'] = round(similarity, 1)
+            matches.append(match)
         
-        # Ordena por Delta E (menor = mais similar)
-        matches.sort(key=lambda x: x['delta_e'])
-        
-        # Retorna top N
-        return matches[:limit]
+        return matches
     
     def find_by_code(self, code):
-        """Busca uma cor específica pelo código"""
-        return self.db.get_by_code(code)
+        """
+        Busca uma cor específica pelo código (sem diferenciar maiúsculas e espaços).
+        
+        Returns:
+            Cópia do registro da cor, ou None se o código não existe
+        """
+        self.refresh_catalogs()
+        color = self.colors_by_code.get(normalize_code(code))
+        return dict(color) if color else None
     
     def find_similar_colors_from_image(self, image_file, limit=5, use_extracted=True, 
-                                       lightness_boost=1.05, n_clusters=3, fabric_mode=False):
+                                       lightness_boost=1.05, n_clusters=3, fabric_mode=False,
+                                       white_threshold=WHITE_THRESHOLD, black_threshold=BLACK_THRESHOLD,
+                                       extractor=DEFAULT_EXTRACTOR, fields=None, roi=None, mask=None):
         """
         Extrai cor dominante de uma imagem e encontra Pantone correspondente.
         
         Args:
-            image_file: Arquivo de imagem (upload)
+            image_file: Arquivo de imagem (upload, caminho ou bytes); bytes quando há extraction_pool
             limit: Número de resultados a retornar
             use_extracted: Se True, usa extracted_hex; senão, usa visual_hex
             lightness_boost: Fator de ganho de luminosidade (padrão: 1.05 = 5% mais claro)
             fabric_mode: Se True, aplica compensação para tecidos (escurece 12%)
             n_clusters: Número de clusters para K-Means (padrão: 3)
+            white_threshold: Limite para ignorar pixels de fundo branco (padrão: 240)
+            black_threshold: Limite para ignorar pixels de sombra (padrão: 10)
+            extractor: Backend de extração (kmeans, minibatch ou histogram)
+            fields: Campos de MATCH_FIELDS a incluir em cada resultado (None = todos)
+            roi: Região (image_pipeline.parse_roi) de onde extrair; None = imagem inteira
+            mask: Bytes de uma imagem máscara (alfa ou luminância); None = sem máscara
         
         Returns:
             Dicionário com:
                 - extracted_hex: HEX da cor extraída da imagem
                 - results: Lista de cores Pantone similares
+        
+        Raises:
+            PoolSaturatedError / ExtractionTimeoutError: do extraction_pool, se houver
         """
-        # Extracts dominant color from image
-        extracted_hex = extract_dominant_color_from_image(image_file, n_clusters=n_clusters, fabric_mode=fabric_mode)
+        # Extracts dominant color from image (in the worker pool, if any)
+        extract_kwargs = dict(
+            n_clusters=n_clusters,
+            fabric_mode=fabric_mode,
+            white_threshold=white_threshold,
+            black_threshold=black_threshold,
+            extractor=extractor,
+            roi=roi,
+            mask=mask
+        )
+        key = cache_key(
+            extract_dominant_color_from_image.__name__,
+            upload_digest(image_file),
+            **dict(extract_kwargs, mask=upload_digest(mask) if mask is not None else None)
+        )
+        extracted_hex = self.extraction_cache.get(key)
+        if extracted_hex is None:
+            if self.extraction_pool is not None:
+                extracted_hex = self.extraction_pool.run(
+                    extract_dominant_color_from_image, image_file, **extract_kwargs
+                )
+            else:
+                extracted_hex = extract_dominant_color_from_image(image_file, **extract_kwargs)
+            self.extraction_cache.put(key, extracted_hex)
         
         if not extracted_hex:
             return {
@@ -356,7 +726,8 @@ class ColorMatcher:
             extracted_hex, 
             limit=limit, 
             use_extracted=use_extracted,
-            lightness_boost=lightness_boost
+            lightness_boost=lightness_boost,
+            fields=fields
         )
         
         return {
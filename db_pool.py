@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Pool of long-lived, read-only SQLite connections.
+
+Opening a connection costs a file open, schema parse and pragma setup on
+every request; the pool keeps connections open and hands each one to a
+single thread at a time:
+
+    with pool.connection() as conn:
+        row = conn.execute(SELECT_BY_CODE, (code,)).fetchone()
+
+Connections are opened read-only (`mode=ro`, `query_only`) with a memory
+map of the database file. The database is switched to WAL once, so the
+readers never block, or get blocked by, a rebuild writing to it. Queries
+should be module-level SQL constants: sqlite3 keeps a per-connection cache
+of prepared statements keyed on the SQL text, so a constant string is
+compiled once per connection and reused afterwards.
+
+Configuration (environment):
+    SMARTCOLOR_SQLITE_MMAP_BYTES   mmap_size per connection (default: 256 MiB)
+    SMARTCOLOR_SQLITE_POOL_SIZE    idle connections kept open (default: 8)
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+
+MMAP_BYTES = int(os.environ.get("SMARTCOLOR_SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+POOL_SIZE = int(os.environ.get("SMARTCOLOR_SQLITE_POOL_SIZE", "8"))
+
+# Prepared statements cached per connection (sqlite3 default: 128).
+_CACHED_STATEMENTS = 64
+
+
+def enable_wal(db_path):
+    """
+    Switches the database to WAL journaling (persistent, so done once).
+
+    Returns:
+        The journal mode in effect, or None if the database could not be
+        opened for writing (missing file, read-only filesystem)
+    """
+    if not os.path.exists(db_path):
+        return None
+    try:
+        conn = sqlite3.connect(db_path, timeout=5)
+        try:
+            return conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+class ConnectionPool:
+    """Thread-safe pool of read-only connections to one SQLite file."""
+
+    def __init__(self, db_path, size=POOL_SIZE, mmap_bytes=MMAP_BYTES):
+        self.db_path = db_path
+        self.size = max(0, int(size))
+        self.mmap_bytes = max(0, int(mmap_bytes))
+        self.journal_mode = enable_wal(db_path)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._opened = 0
+        self._reused = 0
+
+    def _open(self):
+        uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro"
+        # check_same_thread=False: a connection may be returned by one thread
+        # and checked out by another, but is never used by two at once.
+        conn = sqlite3.connect(
+            uri, uri=True, check_same_thread=False, cached_statements=_CACHED_STATEMENTS,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only=1")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_bytes}")
+        with self._lock:
+            self._opened += 1
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection for the duration of the `with` block."""
+        with self._lock:
+            generation = self._generation
+            conn = self._idle.pop() if self._idle else None
+            if conn is not None:
+                self._reused += 1
+        if conn is None:
+            conn = self._open()
+
+        try:
+            yield conn
+        except sqlite3.Error:
+            # The connection may be unusable (e.g. the file was replaced)
+            conn.close()
+            raise
+        except BaseException:
+            self._checkin(conn, generation)
+            raise
+        else:
+            self._checkin(conn, generation)
+
+    def _checkin(self, conn, generation):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if generation == self._generation and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def reset(self):
+        """
+        Closes idle connections and retires checked-out ones on return.
+
+        Call after the database file was replaced (not just written to), so
+        no connection keeps reading the old file.
+        """
+        with self._lock:
+            self._generation += 1
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+        self.journal_mode = enable_wal(self.db_path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "db_path": self.db_path,
+                "journal_mode": self.journal_mode,
+                "idle": len(self._idle),
+                "size": self.size,
+                "opened": self._opened,
+                "reused": self._reused,
+            }
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Cache of image extraction results keyed on the upload's content.
+
+Repeat uploads of the same photo with the same extraction parameters skip
+decoding and clustering and go straight to matching. Keys are the SHA-256
+of the upload (and of the mask, if any) plus every parameter that affects
+the result, so a hit is always the result a fresh extraction would give.
+
+Two tiers:
+    memory  LRUCache of SMARTCOLOR_EXTRACTION_CACHE_SIZE entries
+    disk    optional directory of small JSON files, shared by processes and
+            kept under SMARTCOLOR_EXTRACTION_CACHE_MAX_BYTES by evicting the
+            least recently used files (by mtime, refreshed on every hit)
+
+Only successful results are cached; bump EXTRACTION_VERSION when the
+pipeline changes what it returns for the same input.
+
+Configuration (environment):
+    SMARTCOLOR_EXTRACTION_CACHE_SIZE       memory entries (default: 1024, 0 disables)
+    SMARTCOLOR_EXTRACTION_CACHE_DIR        disk tier directory (default: unset, disabled)
+    SMARTCOLOR_EXTRACTION_CACHE_MAX_BYTES  disk tier size (default: 64 MiB)
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from result_cache import LRUCache
+
+EXTRACTION_VERSION = 1
+
+MEMORY_SIZE = int(os.environ.get("SMARTCOLOR_EXTRACTION_CACHE_SIZE", "1024"))
+DISK_DIR = os.environ.get("SMARTCOLOR_EXTRACTION_CACHE_DIR", "").strip()
+DISK_MAX_BYTES = int(os.environ.get("SMARTCOLOR_EXTRACTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def upload_digest(image):
+    """
+    SHA-256 (hex) of an upload given as bytes, a path or a seekable binary
+    file object. A file object is read in chunks and rewound, so it can
+    still be passed on to the extraction.
+    """
+    digest = hashlib.sha256()
+    if isinstance(image, (bytes, bytearray)):
+        digest.update(image)
+        return digest.hexdigest()
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+    start = image.tell()
+    for chunk in iter(lambda: image.read(1 << 20), b""):
+        digest.update(chunk)
+    image.seek(start)
+    return digest.hexdigest()
+
+
+def cache_key(kind, image_digest, **params):
+    """
+    Key of one extraction: its kind (e.g. the extraction function), the
+    upload digest and the parameters (JSON-serializable values).
+    """
+    payload = json.dumps(
+        [EXTRACTION_VERSION, kind, image_digest, params], sort_keys=True, default=list,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """Memory LRU in front of an optional size-bounded disk directory."""
+
+    def __init__(self, maxsize=MEMORY_SIZE, directory=DISK_DIR, max_bytes=DISK_MAX_BYTES):
+        self.memory = LRUCache(maxsize=maxsize)
+        self.directory = directory or None
+        self.max_bytes = max(0, int(max_bytes))
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+        self.disk_hits = 0
+        self.disk_evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Cached result for key, or None."""
+        value = self.memory.get(key)
+        if value is not None or self.directory is None:
+            return value
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as fh:
+                value = json.load(fh)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self.memory.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """Stores a JSON-serializable result (None is not cached)."""
+        if value is None:
+            return
+        self.memory.put(key, value)
+        if self.directory is None or self.max_bytes == 0:
+            return
+
+        path = self._path(key)
+        data = json.dumps(value).encode("utf-8")
+        try:
+            # Size of the file this put replaces, if any
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+            else:
+                self._disk_bytes += len(data) - replaced
+            if self._disk_bytes > self.max_bytes:
+                self._evict()
+
+    def _disk_entries(self):
+        """(mtime, size, path) of every cached file."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        # Rescans, since other processes share the directory; trims to 90%
+        # so the next few puts do not rescan again.
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            self.disk_evictions += 1
+        self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory": self.memory.stats(),
+                "disk_dir": self.directory,
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.max_bytes if self.directory else None,
+                "disk_hits": self.disk_hits,
+                "disk_evictions": self.disk_evictions,
+            }
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Process pool that runs image color extraction off the request thread.
+
+Decode, resize and clustering are CPU-bound and hold the GIL, so the Flask
+apps hand them to worker processes. The pool admits at most
+`workers + queue_depth` jobs at a time; beyond that `run` raises
+PoolSaturatedError right away (the apps answer 503) instead of queueing
+without bound. Jobs that take longer than `timeout` raise
+ExtractionTimeoutError.
+
+Configuration (environment):
+    SMARTCOLOR_IMAGE_WORKERS          worker processes (0 = run inline, default)
+    SMARTCOLOR_IMAGE_QUEUE_DEPTH      jobs allowed to wait for a worker (default: workers)
+    SMARTCOLOR_IMAGE_TIMEOUT_SECONDS  per-job timeout (default: 30)
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+
+class PoolSaturatedError(RuntimeError):
+    """Every worker is busy and the wait queue is full."""
+
+
+class ExtractionTimeoutError(RuntimeError):
+    """The job did not finish within the pool timeout."""
+
+
+class ExtractionPool:
+    """Bounded process pool for CPU-heavy image jobs."""
+
+    def __init__(self, workers=0, queue_depth=None, timeout=30.0):
+        self.workers = max(0, int(workers))
+        self.queue_depth = self.workers if queue_depth is None else max(0, int(queue_depth))
+        self.timeout = float(timeout)
+        self._slots = threading.BoundedSemaphore(max(1, self.workers + self.queue_depth))
+        self._lock = threading.Lock()
+        self._executor = None
+        self._in_flight = 0
+        self._rejected = 0
+        self._timeouts = 0
+
+    @classmethod
+    def from_env(cls):
+        workers = int(os.environ.get("SMARTCOLOR_IMAGE_WORKERS", "0"))
+        queue_depth = os.environ.get("SMARTCOLOR_IMAGE_QUEUE_DEPTH")
+        timeout = float(os.environ.get("SMARTCOLOR_IMAGE_TIMEOUT_SECONDS", "30"))
+        return cls(
+            workers=workers,
+            queue_depth=int(queue_depth) if queue_depth else None,
+            timeout=timeout,
+        )
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a threaded web server can deadlock the child
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs) in a worker process and returns its result.
+
+        fn and its arguments must be picklable (module-level function, bytes
+        instead of open files). With workers=0 the call runs inline.
+
+        Raises:
+            PoolSaturatedError: No free worker or queue slot
+            ExtractionTimeoutError: The job exceeded the timeout
+        """
+        if self.workers == 0:
+            return fn(*args, **kwargs)
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PoolSaturatedError("Image workers are busy, retry shortly.")
+        with self._lock:
+            self._in_flight += 1
+
+        try:
+            future = self._get_executor().submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next job.
+            with self._lock:
+                self._executor = None
+            self._release()
+            raise
+        except Exception:
+            self._release()
+            raise
+        # The slot stays taken until the worker is really done, even when
+        # the caller stops waiting after a timeout.
+        future.add_done_callback(self._release)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except BrokenProcessPool:
+            with self._lock:
+                self._executor = None
+            raise
+        except FuturesTimeoutError:
+            future.cancel()
+            with self._lock:
+                self._timeouts += 1
+            raise ExtractionTimeoutError(f"Image processing took longer than {self.timeout:g}s.")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue_depth,
+                "timeout_seconds": self.timeout,
+                "in_flight": self._in_flight,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+            }
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Compares the dominant-color extractor backends on a set of images.
+
+For every image, each backend in image_pipeline.EXTRACTORS extracts the
+dominant color; the report shows how far it lands (CIEDE2000) from the
+reference backend (full KMeans) and how long the clustering took.
+
+    python extractor_report.py photos/ swatch.jpg --n-clusters 3
+
+Without paths, a deterministic synthetic fixture set is generated.
+"""
+
+import argparse
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from color_engine import delta_e_cie2000, srgb_to_lab
+from image_pipeline import EXTRACTORS, dominant_rgb, filter_background_pixels, load_pixels
+
+REFERENCE = 'kmeans'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+
+
+def synthetic_fixtures(size=400, seed=7):
+    """Yields (name, pixels) for generated swatch-like images."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size]
+
+    for i in range(4):
+        # Fabric swatch on a white table with a dark shadow band
+        base = rng.integers(20, 235, 3)
+        img = np.full((size, size, 3), 250, dtype=np.int64)
+        weave = ((xx // 3 + yy // 3) % 2)[..., None] * rng.integers(8, 25)
+        noise = rng.normal(0, 6, (size, size, 3))
+        inside = (slice(size // 8, size - size // 8), slice(size // 6, size - size // 6))
+        img[inside] = (base + weave + noise)[inside]
+        img[size // 2:size // 2 + size // 20, :] = 4
+        yield f'swatch-{i}', np.clip(img, 0, 255).astype(np.uint8)
+
+    for i in range(2):
+        # Two-tone print with a 70/30 split
+        first, second = rng.integers(0, 256, (2, 3))
+        img = np.where((xx < size * 0.7)[..., None], first, second)
+        img = img + rng.normal(0, 4, (size, size, 3))
+        yield f'two-tone-{i}', np.clip(img, 0, 255).astype(np.uint8)
+
+    # Smooth gradient (worst case for quantizers)
+    start, end = rng.integers(0, 256, (2, 3))
+    t = (xx / (size - 1))[..., None]
+    yield 'gradient', np.clip(start + (end - start) * t, 0, 255).astype(np.uint8)
+
+
+def image_fixtures(paths):
+    """Yields (name, path) for image files given directly or inside directories."""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield name, os.path.join(path, name)
+        else:
+            yield os.path.basename(path), path
+
+
+def run_report(fixtures, n_clusters=3):
+    """Prints one line per image and backend plus a per-backend summary."""
+    summary = {name: {'delta_e': [], 'ms': []} for name in EXTRACTORS}
+
+    print(f"{'image':<24} {'backend':<10} {'hex':<8} {'dE00':>6} {'ms':>8}")
+    for name, source in fixtures:
+        if isinstance(source, np.ndarray):
+            # Goes through the same decode + resize path as an upload
+            buffer = BytesIO()
+            Image.fromarray(source).save(buffer, format='PNG')
+            source = buffer.getvalue()
+        pixels = filter_background_pixels(load_pixels(source))
+
+        colors = {}
+        for backend in EXTRACTORS:
+            started = time.perf_counter()
+            colors[backend] = dominant_rgb(pixels, n_clusters=n_clusters, extractor=backend)
+            summary[backend]['ms'].append((time.perf_counter() - started) * 1000.0)
+
+        reference_lab = srgb_to_lab(np.array(colors[REFERENCE]) / 255.0)
+        for backend, rgb in colors.items():
+            distance = float(delta_e_cie2000(reference_lab, srgb_to_lab(np.array(rgb) / 255.0)))
+            summary[backend]['delta_e'].append(distance)
+            hex_color = '#{:02x}{:02x}{:02x}'.format(*rgb)
+            print(f"{name[:24]:<24} {backend:<10} {hex_color:<8} {distance:>6.2f} "
+                  f"{summary[backend]['ms'][-1]:>8.1f}")
+
+    print()
+    print(f"{'backend':<10} {'mean dE00':>10} {'max dE00':>9} {'mean ms':>8}")
+    for backend, values in summary.items():
+        if not values['ms']:
+            continue
+        print(f"{backend:<10} {np.mean(values['delta_e']):>10.2f} {np.max(values['delta_e']):>9.2f} "
+              f"{np.mean(values['ms']):>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare dominant-color extractor backends')
+    parser.add_argument('paths', nargs='*', help='Images or directories (default: synthetic fixtures)')
+    parser.add_argument('--n-clusters', type=int, default=3, help='Clusters per image')
+    args = parser.parse_args()
+
+    fixtures = image_fixtures(args.paths) if args.paths else synthetic_fixtures()
+    run_report(fixtures, n_clusters=args.n_clusters)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Image processing steps shared by `color_matcher` and `mvp_api`.
+
+Both dominant-color extractors go through these functions so the two entry
+points apply exactly the same pixel handling:
+
+    load_pixels -> filter_background_pixels -> cluster_pixels
+
+or, to extract from part of the image only (a rectangle or polygon ROI
+and/or a mask), region_pixels instead of load_pixels. region_pixels works
+on a working-resolution decode that is cached for DECODED_CACHE_TTL
+seconds under the upload's SHA-256, so refining the ROI on the same photo
+does not decode it again. The cache is per process (each extraction
+worker has its own).
+
+cluster_pixels dispatches to one of the EXTRACTORS backends:
+    kmeans     - KMeans with 10 initializations (reference, slowest)
+    minibatch  - MiniBatchKMeans with a single initialization
+    histogram  - median-cut quantization of a 5-bit-per-channel histogram
+
+PIL and scikit-learn are imported on first use, so importing this module
+(e.g. for its constants, or for HEX-only matching) stays cheap.
+"""
+
+import hashlib
+import json
+import math
+import os
+from io import BytesIO
+
+import numpy as np
+
+from result_cache import LRUCache
+
+# Pixels with every channel above WHITE_THRESHOLD are treated as white
+# background, and pixels with every channel below BLACK_THRESHOLD as shadow.
+WHITE_THRESHOLD = 240
+BLACK_THRESHOLD = 10
+
+# Side of the square the image is resized to before clustering.
+SAMPLE_SIZE = 100
+
+# JPEG draft decoding keeps at least this multiple of SAMPLE_SIZE, and the
+# resize box-reduces until the remaining factor is below REDUCING_GAP.
+DRAFT_OVERSAMPLE = 2
+REDUCING_GAP = 2.0
+
+DEFAULT_EXTRACTOR = 'kmeans'
+
+# Longest side of the cached decode region_pixels crops from, and how many
+# decodes are kept, for how long.
+DECODE_MAX_SIDE = int(os.environ.get('SMARTCOLOR_DECODE_MAX_SIDE', '1024'))
+DECODED_CACHE_SIZE = int(os.environ.get('SMARTCOLOR_DECODED_CACHE_SIZE', '8'))
+DECODED_CACHE_TTL = float(os.environ.get('SMARTCOLOR_DECODED_CACHE_TTL', '120'))
+
+# Mask / alpha values at or above this select a pixel.
+MASK_THRESHOLD = 128
+
+_decoded_cache = LRUCache(maxsize=DECODED_CACHE_SIZE, ttl=DECODED_CACHE_TTL)
+
+
+def load_pixels(image_file, size=SAMPLE_SIZE):
+    """
+    Opens an image and returns its pixels resized to size x size.
+
+    JPEGs are decoded in draft mode, letting libjpeg scale by 1/2, 1/4 or 1/8
+    during decoding, so a phone photo never exists in memory at full
+    resolution. The resize then box-reduces by an integer factor before the
+    final LANCZOS pass (reducing_gap), which is much cheaper than LANCZOS
+    over the whole source when the downscale factor is large.
+
+    Args:
+        image_file: Path, bytes or binary file object (read in place, e.g.
+            an upload stream; it is not copied into a second buffer)
+        size: Side of the resized square
+
+    Returns:
+        (size * size, 3) uint8 array of RGB pixels
+    """
+    if isinstance(image_file, (bytes, bytearray)):
+        image_file = BytesIO(image_file)
+    from PIL import Image
+    with Image.open(image_file) as img:
+        if img.format == 'JPEG':
+            # Keeps at least DRAFT_OVERSAMPLE x the target size for the resize
+            img.draft('RGB', (size * DRAFT_OVERSAMPLE, size * DRAFT_OVERSAMPLE))
+        img = img.convert('RGB')
+    try:
+        # Pillow >= 10.0
+        img = img.resize((size, size), Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+    except AttributeError:
+        # Pillow < 10.0
+        img = img.resize((size, size), Image.LANCZOS, reducing_gap=REDUCING_GAP)
+    return np.array(img).reshape(-1, 3)
+
+
+def read_bytes(image_file):
+    """The bytes of an upload given as bytes or a binary file object."""
+    if isinstance(image_file, (bytes, bytearray)):
+        return bytes(image_file)
+    return image_file.read()
+
+
+def decode_image(image_bytes, max_side=DECODE_MAX_SIDE):
+    """
+    Decodes an image to RGBA at most max_side pixels on its longest side.
+
+    Results are cached by content hash (see DECODED_CACHE_TTL).
+
+    Returns:
+        (rgba, source_size): (H, W, 4) uint8 array and the (width, height)
+        of the original image
+    """
+    key = (hashlib.sha256(image_bytes).hexdigest(), max_side)
+    cached = _decoded_cache.get(key)
+    if cached is not None:
+        return cached
+
+    from PIL import Image
+    with Image.open(BytesIO(image_bytes)) as img:
+        source_size = img.size
+        if img.format == 'JPEG':
+            img.draft('RGB', (max_side, max_side))
+        img = img.convert('RGBA')
+    img.thumbnail((max_side, max_side), getattr(Image, 'Resampling', Image).LANCZOS, reducing_gap=REDUCING_GAP)
+    decoded = (np.asarray(img), source_size)
+    _decoded_cache.put(key, decoded)
+    return decoded
+
+
+def parse_roi(value):
+    """
+    Parses a region of interest, in pixels of the original image:
+
+        {"x": 10, "y": 20, "width": 300, "height": 200}    rectangle
+        [[x1, y1], [x2, y2], [x3, y3], ...]              polygon (3+ points)
+
+    Args:
+        value: JSON string or already-decoded value; empty means no ROI
+
+    Returns:
+        None, ('rect', (x0, y0, x1, y1)) or ('polygon', [(x, y), ...])
+
+    Raises:
+        ValueError: Malformed ROI
+    """
+    if value in (None, '', [], {}):
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"ROI is not valid JSON: {exc}") from None
+    try:
+        if isinstance(value, dict):
+            x, y = float(value['x']), float(value['y'])
+            width, height = float(value['width']), float(value['height'])
+            if width <= 0 or height <= 0:
+                raise ValueError("ROI width and height must be positive")
+            return 'rect', (x, y, x + width, y + height)
+        points = [(float(x), float(y)) for x, y in value]
+    except (KeyError, TypeError) as exc:
+        raise ValueError(f"Malformed ROI: {exc}") from None
+    if len(points) < 3:
+        raise ValueError("A polygon ROI needs at least 3 points")
+    return 'polygon', points
+
+
+def _mask_values(mask_bytes, size):
+    """Mask image as (H, W) uint8 at `size`: its alpha channel, else its luminance."""
+    from PIL import Image
+    with Image.open(BytesIO(mask_bytes)) as mask:
+        has_alpha = mask.mode in ('RGBA', 'LA', 'PA') or 'transparency' in mask.info
+        mask = mask.convert('RGBA').getchannel('A') if has_alpha else mask.convert('L')
+    return np.asarray(mask.resize(size, getattr(Image, 'Resampling', Image).BILINEAR))
+
+
+def region_pixels(image_file, roi=None, mask=None, size=SAMPLE_SIZE):
+    """
+    Pixels of part of an image, resized like load_pixels.
+
+    The region is the intersection of the ROI (whole image if None), the
+    mask and the image's own alpha channel. Its bounding box is resized to
+    size x size and the pixels outside the region are dropped.
+
+    Args:
+        image_file: Bytes or binary file object
+        roi: Result of parse_roi
+        mask: Bytes of a mask image (alpha channel, or luminance without
+            one, >= MASK_THRESHOLD selects), stretched to the image size
+        size: Side of the resized bounding box
+
+    Returns:
+        (N, 3) uint8 array of RGB pixels
+
+    Raises:
+        ValueError: The region is empty
+    """
+    from PIL import Image, ImageDraw
+
+    rgba, (source_width, source_height) = decode_image(read_bytes(image_file))
+    height, width = rgba.shape[:2]
+    scale_x, scale_y = width / source_width, height / source_height
+
+    if roi is None:
+        selected = np.ones((height, width), dtype=bool)
+    else:
+        kind, coords = roi
+        canvas = Image.new('L', (width, height), 0)
+        draw = ImageDraw.Draw(canvas)
+        if kind == 'rect':
+            x0, y0, x1, y1 = coords
+            # Whole decoded pixels touched by the ROI (inclusive), at least
+            # one even when the ROI is narrower than a decoded pixel
+            left, top = math.floor(x0 * scale_x), math.floor(y0 * scale_y)
+            right = max(left, math.ceil(x1 * scale_x) - 1)
+            bottom = max(top, math.ceil(y1 * scale_y) - 1)
+            draw.rectangle([left, top, right, bottom], fill=255)
+        else:
+            draw.polygon([(x * scale_x, y * scale_y) for x, y in coords], fill=255)
+        selected = np.asarray(canvas) > 0
+    selected &= rgba[..., 3] >= MASK_THRESHOLD
+    if mask is not None:
+        selected &= _mask_values(mask, (width, height)) >= MASK_THRESHOLD
+
+    rows = np.flatnonzero(selected.any(axis=1))
+    columns = np.flatnonzero(selected.any(axis=0))
+    if not len(rows):
+        raise ValueError("The ROI / mask selects no pixels")
+    box = (columns[0], rows[0], columns[-1] + 1, rows[-1] + 1)
+
+    resample = getattr(Image, 'Resampling', Image)
+    crop = Image.fromarray(rgba[..., :3]).crop(box).resize(
+        (size, size), resample.LANCZOS, reducing_gap=REDUCING_GAP,
+    )
+    crop_mask = Image.fromarray(selected.astype(np.uint8) * 255).crop(box).resize((size, size), resample.BILINEAR)
+    pixels = np.asarray(crop).reshape(-1, 3)
+    keep = np.asarray(crop_mask).reshape(-1) >= MASK_THRESHOLD
+    if not keep.any():
+        raise ValueError("The ROI / mask selects no pixels")
+    return pixels[keep]
+
+
+def extraction_pixels(image_file, roi=None, mask=None):
+    """load_pixels, or region_pixels when a ROI or a mask is given."""
+    if roi is None and mask is None:
+        return load_pixels(image_file)
+    return region_pixels(image_file, roi=roi, mask=mask)
+
+
+def filter_background_pixels(pixels, white_threshold=WHITE_THRESHOLD, black_threshold=BLACK_THRESHOLD):
+    """
+    Drops near-white and near-black pixels with a boolean mask.
+
+    Args:
+        pixels: Array (..., 3) of RGB values (0-255)
+        white_threshold: Pixels with R, G and B all above this are dropped
+        black_threshold: Pixels with R, G and B all below this are dropped
+
+    Returns:
+        (N, 3) array of the remaining pixels, or all pixels if every one
+        of them was filtered out
+    """
+    pixels = np.asarray(pixels).reshape(-1, 3)
+    background = np.all(pixels > white_threshold, axis=1) | np.all(pixels < black_threshold, axis=1)
+    filtered = pixels[~background]
+    if len(filtered) == 0:
+        return pixels
+    return filtered
+
+
+def _cluster_kmeans(pixels, n_clusters):
+    from sklearn.cluster import KMeans
+    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+    kmeans.fit(pixels)
+    return kmeans.cluster_centers_, np.bincount(kmeans.labels_, minlength=n_clusters)
+
+
+def _cluster_minibatch(pixels, n_clusters):
+    from sklearn.cluster import MiniBatchKMeans
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=1, batch_size=1024)
+    kmeans.fit(pixels)
+    return kmeans.cluster_centers_, np.bincount(kmeans.labels_, minlength=n_clusters)
+
+
+def _cluster_histogram(pixels, n_clusters, bits=5):
+    """
+    Median cut over a 3D color histogram.
+
+    Pixels are binned at `bits` bits per channel; each bin keeps its pixel
+    count and mean color. The box with the widest channel range is split at
+    the pixel-weighted median of that channel until there are n_clusters
+    boxes (or nothing left to split).
+    """
+    pixels = pixels.astype(np.int64)
+    shift = 8 - bits
+    keys = ((pixels[:, 0] >> shift) << (2 * bits)) | ((pixels[:, 1] >> shift) << bits) | (pixels[:, 2] >> shift)
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    sums = np.column_stack([np.bincount(inverse, weights=pixels[:, c]) for c in range(3)])
+    colors = sums / counts[:, None]
+
+    boxes = [np.arange(len(counts))]
+    while len(boxes) < n_clusters:
+        best, best_range, best_channel = None, 0.0, 0
+        for i, box in enumerate(boxes):
+            if len(box) < 2:
+                continue
+            spread = colors[box].max(axis=0) - colors[box].min(axis=0)
+            channel = int(np.argmax(spread))
+            if spread[channel] > best_range:
+                best, best_range, best_channel = i, spread[channel], channel
+        if best is None:
+            break
+
+        box = boxes.pop(best)
+        box = box[np.argsort(colors[box, best_channel], kind='stable')]
+        cumulative = np.cumsum(counts[box])
+        cut = int(np.searchsorted(cumulative, cumulative[-1] / 2.0)) + 1
+        cut = min(max(cut, 1), len(box) - 1)
+        boxes.extend([box[:cut], box[cut:]])
+
+    box_counts = np.array([counts[box].sum() for box in boxes])
+    centers = np.array([sums[box].sum(axis=0) / counts[box].sum() for box in boxes])
+    return centers, box_counts
+
+
+EXTRACTORS = {
+    'kmeans': _cluster_kmeans,
+    'minibatch': _cluster_minibatch,
+    'histogram': _cluster_histogram,
+}
+
+
+def cluster_pixels(pixels, n_clusters=3, extractor=DEFAULT_EXTRACTOR):
+    """
+    Groups pixels into color clusters with the chosen backend.
+
+    Args:
+        pixels: (N, 3) array of RGB pixels (N > 0)
+        n_clusters: Number of clusters (clamped to 1..N)
+        extractor: Name of a backend in EXTRACTORS
+
+    Returns:
+        (centers, counts): (K, 3) float RGB centers and the pixel count of each
+
+    Raises:
+        ValueError: Unknown extractor name
+    """
+    if extractor not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor: {extractor}. Use one of: {', '.join(EXTRACTORS)}")
+    n_clusters = min(max(1, int(n_clusters)), len(pixels))
+    return EXTRACTORS[extractor](pixels, n_clusters)
+
+
+def dominant_rgb(pixels, n_clusters=3, extractor=DEFAULT_EXTRACTOR):
+    """(r, g, b) ints (0-255) of the most populated cluster."""
+    centers, counts = cluster_pixels(pixels, n_clusters=n_clusters, extractor=extractor)
+    dominant = centers[int(np.argmax(counts))]
+    return tuple(int(np.clip(channel, 0, 255)) for channel in dominant)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Import-time budget for the server and CLI entry points.
+
+Each module is imported in a fresh interpreter (best of --repeat runs,
+interpreter startup excluded) and must stay under its budget in
+milliseconds. The heavy optional dependencies (scikit-learn, colormath,
+PIL) must not be loaded by the import at all: they belong to the image
+and legacy code paths only. Exits with status 1 on any violation, so it
+can run as a CI step:
+
+    python import_budget.py
+    python import_budget.py --budget color_matcher=300 --repeat 5
+
+Budgets can also be scaled for slower machines with
+SMARTCOLOR_IMPORT_BUDGET_SCALE (e.g. 2 doubles every budget).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Module -> budget in milliseconds (numpy and Flask dominate).
+BUDGETS_MS = {
+    'color_matcher': 400,
+    'matcher_app': 800,
+    'mvp_api': 800,
+}
+
+DEFERRED_MODULES = ('sklearn', 'colormath', 'PIL')
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+loaded = sorted({{name.split(".")[0] for name in sys.modules}} & set({deferred!r}))
+print(json.dumps({{"ms": elapsed, "loaded": loaded}}))
+'''
+
+
+def measure(module, repeat=3):
+    """
+    Imports `module` in `repeat` fresh interpreters.
+
+    Returns:
+        (best time in ms, deferred modules the import loaded)
+    """
+    code = _PROBE.format(module=module, deferred=list(DEFERRED_MODULES))
+    best, loaded = None, []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        best = result['ms'] if best is None else min(best, result['ms'])
+        loaded = result['loaded']
+    return best, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check import time against a budget')
+    parser.add_argument('--budget', action='append', default=[], metavar='MODULE=MS',
+                        help='Override or add a module budget')
+    parser.add_argument('--repeat', type=int, default=3, help='Imports per module (best is kept)')
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS_MS)
+    for item in args.budget:
+        module, _, ms = item.partition('=')
+        budgets[module] = float(ms)
+    scale = float(os.environ.get('SMARTCOLOR_IMPORT_BUDGET_SCALE', '1'))
+
+    failed = False
+    print(f"{'module':<16} {'ms':>8} {'budget':>8}  deferred loaded")
+    for module, budget in budgets.items():
+        try:
+            elapsed, loaded = measure(module, repeat=max(1, args.repeat))
+        except subprocess.CalledProcessError as exc:
+            print(f"{module:<16} import failed:\n{exc.stderr}")
+            failed = True
+            continue
+        over = elapsed > budget * scale or loaded
+        failed = failed or bool(over)
+        print(f"{module:<16} {elapsed:>8.1f} {budget * scale:>8.0f}  {', '.join(loaded) or '-'}"
+              f"{'  FAIL' if over else ''}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,14 +12,30 @@ if not hasattr(np, 'asscalar'):
     np.asscalar = asscalar
 
 from flask import Flask, render_template, jsonify, send_file, request
-from color_matcher import ColorMatcher
+from color_matcher import ColorMatcher, parse_fields
+from extraction_pool import ExtractionPool, PoolSaturatedError, ExtractionTimeoutError
+from image_pipeline import WHITE_THRESHOLD, BLACK_THRESHOLD, DEFAULT_EXTRACTOR, EXTRACTORS, parse_roi
+from swatch_images import image_info, cache_control, thumbnail
 from werkzeug.utils import secure_filename
-from io import BytesIO
-import os
+import threading
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-matcher = ColorMatcher()
+# Extração de cor das imagens em processos separados (SMARTCOLOR_IMAGE_WORKERS)
+image_pool = ExtractionPool.from_env()
+# O ColorMatcher (banco, catálogos, tabelas RGB) só é criado na primeira
+# requisição que precisa dele, não na importação do módulo
+_matcher = None
+_matcher_lock = threading.Lock()
+
+def get_matcher():
+    """ColorMatcher compartilhado, criado no primeiro uso"""
+    global _matcher
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                _matcher = ColorMatcher(extraction_pool=image_pool)
+    return _matcher
 
 # Extensões permitidas
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
@@ -46,9 +62,9 @@ def match_color():
             return jsonify({'error': 'Invalid file type. Allowed: PNG, JPG, JPEG, GIF, WEBP'}), 400
         
         try:
-            # Lê o arquivo em memória
-            image_data = file.read()
-            image_file = BytesIO(image_data)
+            # Sem pool, o PIL lê direto do stream do upload (sem cópia extra em
+            # memória); com pool, os bytes são enviados ao processo worker
+            image_data = file.read() if image_pool.workers else file.stream
             
             # Parâmetros opcionais
             use_extracted = request.form.get('use_extracted', 'true').lower() == 'true'
@@ -56,44 +72,55 @@ def match_color():
             lightness_boost = float(request.form.get('lightness_boost', 1.05))
             n_clusters = int(request.form.get('n_clusters', 3))
             fabric_mode = request.form.get('fabric_mode', 'true').lower() == 'true'
+            white_threshold = int(request.form.get('white_threshold', WHITE_THRESHOLD))
+            black_threshold = int(request.form.get('black_threshold', BLACK_THRESHOLD))
+            extractor = request.form.get('extractor', DEFAULT_EXTRACTOR).strip().lower()
+            
+            if extractor not in EXTRACTORS:
+                return jsonify({'error': f"Invalid extractor. Allowed: {', '.join(EXTRACTORS)}"}), 400
+            
+            # fields=code,hex,delta_e: só esses campos em cada resultado
+            try:
+                fields = parse_fields(request.form.get('fields') or request.args.get('fields'))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            # roi (retângulo ou polígono, em pixels da imagem original) e
+            # máscara opcional: extrai só dessa região, sem novo recorte/upload
+            try:
+                roi = parse_roi(request.form.get('roi'))
+            except ValueError as e:
+                return jsonify({'error': f'Invalid roi: {e}'}), 400
+            mask_file = request.files.get('mask')
+            mask = mask_file.read() if mask_file and mask_file.filename else None
             
             # Extrai cor e busca similares
-            result = matcher.find_similar_colors_from_image(
-                image_file,
+            result = get_matcher().find_similar_colors_from_image(
+                image_data,
                 limit=limit,
                 use_extracted=use_extracted,
                 lightness_boost=lightness_boost,
                 n_clusters=n_clusters,
-                fabric_mode=fabric_mode
+                fabric_mode=fabric_mode,
+                white_threshold=white_threshold,
+                black_threshold=black_threshold,
+                extractor=extractor,
+                fields=fields,
+                roi=roi,
+                mask=mask
             )
             
             if result.get('error'):
                 return jsonify(result), 400
             
-            # Adiciona URLs das imagens
-            for match in result['results']:
-                image_path = match.get('image_path')
-                if image_path:
-                    if not os.path.isabs(image_path):
-                        possible_paths = [
-                            os.path.join('pantone_images', os.path.basename(image_path)),
-                            image_path
-                        ]
-                        for path in possible_paths:
-                            if os.path.exists(path):
-                                image_path = os.path.abspath(path)
-                                match['image_path'] = image_path
-                                break
-                    
-                    if image_path and os.path.exists(image_path):
-                        match['image_url'] = f"/api/image/{match['code']}"
-                    else:
-                        match['image_url'] = None
-                else:
-                    match['image_url'] = None
-            
             return jsonify(result)
             
+        except PoolSaturatedError as e:
+            response = jsonify({'error': str(e)})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        except ExtractionTimeoutError as e:
+            return jsonify({'error': str(e)}), 504
         except Exception as e:
             import traceback
             traceback.print_exc()
@@ -124,40 +151,20 @@ def match_color():
     lightness_boost = data.get('lightness_boost', 1.0)
     
     try:
-        results = matcher.find_similar_colors(
+        fields = parse_fields(data.get('fields') or request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        results = get_matcher().find_similar_colors(
             hex_color, 
             limit=limit, 
             use_extracted=use_extracted,
-            lightness_boost=lightness_boost
+            lightness_boost=lightness_boost,
+            fields=fields
         )
         
-        # Adiciona URL da imagem e garante que image_path existe
-        for result in results:
-            # Garante que image_path está absoluto e existe
-            image_path = result.get('image_path')
-            if image_path:
-                # Se for relativo, tenta encontrar
-                if not os.path.isabs(image_path):
-                    possible_paths = [
-                        os.path.join('pantone_images', os.path.basename(image_path)),
-                        image_path
-                    ]
-                    for path in possible_paths:
-                        if os.path.exists(path):
-                            image_path = os.path.abspath(path)
-                            result['image_path'] = image_path
-                            break
-                else:
-                    if not os.path.exists(image_path):
-                        image_path = None
-                
-                if image_path and os.path.exists(image_path):
-                    result['image_url'] = f"/api/image/{result['code']}"
-                else:
-                    result['image_url'] = None
-            else:
-                result['image_url'] = None
-        
+        # image_path e image_url já vêm resolvidos do catálogo
         return jsonify({
             'input_hex': hex_color,
             'results': results
@@ -167,36 +174,78 @@ def match_color():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/health')
+def health():
+    """Estado do catálogo, do cache de resultados e do pool de imagens"""
+    matcher = get_matcher()
+    matcher.refresh_catalogs()
+    state = matcher.state
+    return jsonify({
+        'ok': True,
+        'catalog_rows': {column: len(catalog) for column, catalog in state.catalogs.items()},
+        'catalog_version': {column: catalog.version for column, catalog in state.catalogs.items()},
+        'result_cache': matcher.result_cache.stats(),
+        'extraction_cache': matcher.extraction_cache.stats(),
+        'rgb_lut': state.lut_status,
+        'image_pool': image_pool.stats(),
+        'sqlite_pool': matcher.pool.stats()
+    })
+
 @app.route('/api/image/<code>')
 def get_image(code):
     """Retorna a imagem de uma cor"""
     try:
-        color = matcher.find_by_code(code)
+        color = get_matcher().find_by_code(code)
         if not color:
             return jsonify({'error': 'Color not found'}), 404
         
+        # Caminho resolvido no carregamento do catálogo
         image_path = color.get('image_path')
+        if not image_path:
+            return jsonify({'error': 'No image path in database'}), 404
+        if not color.get('image_url'):
+            return jsonify({'error': f'Image not found: {image_path}'}), 404
         
-        # Tenta vários caminhos
-        if not image_path or not os.path.exists(image_path):
-            # Tenta caminho relativo
-            if image_path:
-                possible_path = os.path.join('pantone_images', os.path.basename(image_path))
-                if os.path.exists(possible_path):
-                    image_path = possible_path
-                else:
-                    return jsonify({'error': f'Image not found: {color.get("image_path")}'}), 404
-            else:
-                return jsonify({'error': 'No image path in database'}), 404
+        # ETag (hash do conteúdo) e Last-Modified: send_file responde 304
+        # para If-None-Match / If-Modified-Since
+        info = image_info(image_path)
+        served_path, served = image_path, info
         
-        return send_file(image_path, mimetype='image/jpeg')
+        # ?w=<largura>: miniatura (WebP se o navegador aceitar), gerada uma vez
+        width = request.args.get('w')
+        if width:
+            try:
+                width = int(width)
+            except ValueError:
+                return jsonify({'error': 'Invalid width'}), 400
+            if width <= 0:
+                return jsonify({'error': 'Invalid width'}), 400
+            accepts_webp = any(
+                mimetype == 'image/webp' and quality > 0
+                for mimetype, quality in request.accept_mimetypes
+            )
+            served_path, served = thumbnail(image_path, info, width, 'webp' if accepts_webp else 'jpeg')
+        
+        response = send_file(
+            served_path,
+            mimetype=served['mimetype'],
+            etag=served['etag'],
+            last_modified=info['mtime'],
+            conditional=True
+        )
+        response.headers['Cache-Control'] = cache_control(request.args.get('v'), info)
+        if width:
+            response.vary.add('Accept')
+        return response
+    except FileNotFoundError:
+        return jsonify({'error': f'Image not found: {color.get("image_path")}'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/color/<code>')
 def get_color(code):
     """Retorna informações de uma cor"""
-    color = matcher.find_by_code(code)
+    color = get_matcher().find_by_code(code)
     if not color:
         return jsonify({'error': 'Color not found'}), 404
     
@@ -6,39 +6,104 @@ HEX-first matching API to validate plugin behavior quickly.
 """
 
 import os
+import random
 import sqlite3
+import threading
 import time
 from dataclasses import dataclass
-from io import BytesIO
 from pathlib import Path
+from typing import BinaryIO, Optional, Union
 from urllib import error as urlerror
 from urllib import request as urlrequest
+from urllib.parse import urlencode
 import json
 
 from flask import Flask, jsonify, request, make_response
 import numpy as np
-from colormath.color_objects import sRGBColor, LabColor
-from colormath.color_conversions import convert_color
-from colormath.color_diff import delta_e_cie2000
-from PIL import Image
-from sklearn.cluster import KMeans
 
 from build_db_from_json import build_database, DEFAULT_DB_PATH, DEFAULT_JSON_PATH
+from catalog import LabCatalog
+from catalog_binary import load_compiled
+from catalog_snapshot import load_snapshot, save_snapshot
+from color_engine import delta_e_cie2000, hex_to_lab_array
+from db_pool import ConnectionPool
+from result_cache import LRUCache
+from extraction_cache import ExtractionCache, cache_key, upload_digest
+from extraction_pool import ExtractionPool, ExtractionTimeoutError, PoolSaturatedError
+from image_pipeline import (
+    BLACK_THRESHOLD,
+    DEFAULT_EXTRACTOR,
+    EXTRACTORS,
+    WHITE_THRESHOLD,
+    cluster_pixels,
+    dominant_rgb,
+    extraction_pixels,
+    filter_background_pixels,
+    parse_roi,
+)
 
 
 DB_PATH = os.environ.get("SMARTCOLOR_MVP_DB_PATH", DEFAULT_DB_PATH)
 JSON_PATH = os.environ.get("SMARTCOLOR_MVP_JSON_PATH", DEFAULT_JSON_PATH)
+# Columnar build of JSON_PATH (catalog_binary.py), recompiled when the JSON changes;
+# the local catalog when there is no database at DB_PATH.
+COMPILED_CATALOG_PATH = os.environ.get("SMARTCOLOR_MVP_COMPILED_CATALOG", "pantone_catalog.bin")
 XANO_BASE_URL = os.environ.get("XANO_BASE_URL", "").strip().rstrip("/")
 XANO_API_KEY = os.environ.get("XANO_API_KEY", "").strip()
 CATALOG_SOURCE = os.environ.get("SMARTCOLOR_CATALOG_SOURCE", "xano").strip().lower()
 CATALOG_CACHE_TTL_SECONDS = int(os.environ.get("SMARTCOLOR_CATALOG_CACHE_TTL_SECONDS", "60"))
+# Query parameter the Xano endpoint filters on (rows with updated_at >= value);
+# empty disables delta sync and every refresh is a conditional full fetch.
+XANO_UPDATED_SINCE_PARAM = os.environ.get("XANO_UPDATED_SINCE_PARAM", "").strip()
+# Deltas cannot report deleted rows, so a full fetch still runs this often.
+CATALOG_FULL_SYNC_SECONDS = int(os.environ.get("SMARTCOLOR_CATALOG_FULL_SYNC_SECONDS", "3600"))
+# Last good catalog (with Lab values) for instant cold starts; empty disables.
+CATALOG_SNAPSHOT_PATH = os.environ.get("SMARTCOLOR_CATALOG_SNAPSHOT", "catalog_snapshot.npz").strip()
+# Fields of each match; fields= on the match endpoints selects a subset.
+MATCH_FIELDS = ("code", "name", "extracted_hex", "swatch_url", "delta_e", "similarity")
+# Same names as the matcher_app results, for clients written against both.
+MATCH_FIELD_ALIASES = {"hex": "extracted_hex"}
+MAX_BATCH_ITEMS = int(os.environ.get("SMARTCOLOR_MAX_BATCH_ITEMS", "500"))
+# Retry delay after a failed refresh: doubles per consecutive failure, capped, +/-50% jitter.
+CATALOG_RETRY_BASE_SECONDS = float(os.environ.get("SMARTCOLOR_CATALOG_RETRY_BASE_SECONDS", "5"))
+CATALOG_RETRY_MAX_SECONDS = float(os.environ.get("SMARTCOLOR_CATALOG_RETRY_MAX_SECONDS", "300"))
 
 app = Flask(__name__)
+image_pool = ExtractionPool.from_env()
+# Extraction results by upload content hash; repeat uploads skip the pool.
+extraction_cache = ExtractionCache()
+result_cache = LRUCache()
+db_pool = ConnectionPool(DB_PATH)
+
+SELECT_CATALOG = """
+    SELECT code, name, extracted_hex
+    FROM pantone_colors
+    WHERE extracted_hex IS NOT NULL AND extracted_hex != ''
+"""
 
 _catalog_cache = {
     "expires_at": 0.0,
     "colors": [],
+    "catalog": None,
     "source": None,
+    "warning": None,
+    "loaded_at": None,
+    "checked_at": None,
+    "from_snapshot": False,
+    "last_error": None,
+    "last_error_at": None,
+    "failures": 0,
+}
+# Guards _catalog_cache; _refresh_lock makes refreshes single-flight.
+_catalog_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_refresher = {"thread": None}
+# Incremental Xano sync: last ETag, highest updated_at seen, rows by id.
+_xano_sync = {
+    "etag": None,
+    "watermark": None,
+    "rows": {},
+    "full_sync_at": 0.0,
 }
 
 # Fix for colormath + newer numpy compatibility
@@ -48,6 +113,10 @@ if not hasattr(np, "asscalar"):
     np.asscalar = asscalar
 
 
+class CatalogUnavailableError(RuntimeError):
+    """No catalog could be loaded yet (cold start with every source failing)."""
+
+
 @app.after_request
 def add_cors_headers(response):
     response.headers["Access-Control-Allow-Origin"] = "*"
@@ -56,6 +125,13 @@ def add_cors_headers(response):
     return response
 
 
+@app.errorhandler(CatalogUnavailableError)
+def catalog_unavailable(exc):
+    response = jsonify({"error": str(exc)})
+    response.headers["Retry-After"] = "5"
+    return response, 503
+
+
 @dataclass
 class Lab:
     l: float
@@ -68,12 +144,8 @@ def ensure_database():
     if db.exists():
         return
     build_database(JSON_PATH, DB_PATH)
-
-
-def get_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # New file: drop connections to the old one and switch it to WAL
+    db_pool.reset()
 
 
 def normalize_hex(value: str) -> str:
@@ -93,16 +165,13 @@ def hex_to_rgb(value: str):
 
 
 def hex_to_lab(hex_value: str) -> Lab:
-    r, g, b = hex_to_rgb(hex_value)
-    rgb = sRGBColor(r, g, b)
-    lab = convert_color(rgb, LabColor, target_illuminant="d65")
-    return Lab(l=lab.lab_l, a=lab.lab_a, b=lab.lab_b)
+    # Same conversion as colormath's sRGB -> Lab (D65), without importing it
+    l, a, b = hex_to_lab_array([normalize_hex(hex_value)])[0]
+    return Lab(l=float(l), a=float(a), b=float(b))
 
 
 def delta_e_cie2000_from_lab(l1: Lab, l2: Lab) -> float:
-    lab1 = LabColor(l1.l, l1.a, l1.b)
-    lab2 = LabColor(l2.l, l2.a, l2.b)
-    return float(delta_e_cie2000(lab1, lab2))
+    return float(delta_e_cie2000((l1.l, l1.a, l1.b), (l2.l, l2.a, l2.b)))
 
 
 def _xano_headers():
@@ -145,14 +214,31 @@ def _normalize_catalog_row(raw):
     }
 
 
-def fetch_colors_from_xano():
+def _xano_get(params=None, etag=None):
+    """
+    GET /pantone_colors.
+
+    Returns:
+        (rows, etag); rows is None when the server answered 304 Not Modified
+    """
     if not XANO_BASE_URL:
         raise RuntimeError("XANO_BASE_URL is required when SMARTCOLOR_CATALOG_SOURCE=xano.")
 
     url = f"{XANO_BASE_URL}/pantone_colors"
-    req = urlrequest.Request(url, headers=_xano_headers(), method="GET")
-    with urlrequest.urlopen(req, timeout=20) as resp:
-        body = resp.read().decode("utf-8")
+    if params:
+        url = f"{url}?{urlencode(params)}"
+    headers = _xano_headers()
+    if etag:
+        headers["If-None-Match"] = etag
+    req = urlrequest.Request(url, headers=headers, method="GET")
+    try:
+        with urlrequest.urlopen(req, timeout=20) as resp:
+            body = resp.read().decode("utf-8")
+            etag = resp.headers.get("ETag")
+    except urlerror.HTTPError as exc:
+        if exc.code == 304:
+            return None, etag
+        raise
     payload = json.loads(body) if body else []
 
     if isinstance(payload, list):
@@ -161,26 +247,77 @@ def fetch_colors_from_xano():
         rows = payload.get("items") or payload.get("results") or payload.get("data") or []
     else:
         rows = []
+    return rows, etag
+
+
+def _row_key(raw):
+    if isinstance(raw, dict):
+        return raw.get("id") if raw.get("id") is not None else raw.get("code")
+    return None
 
-    colors = []
-    for row in rows:
-        normalized = _normalize_catalog_row(row)
-        if normalized:
-            colors.append(normalized)
-    return colors
+
+def sync_colors_from_xano():
+    """
+    Brings the Xano rows up to date with as little transfer as possible.
+
+    Full fetches send If-None-Match with the last ETag. Between full fetches
+    (every CATALOG_FULL_SYNC_SECONDS), if XANO_UPDATED_SINCE_PARAM is set,
+    only rows updated since the highest `updated_at` seen are requested and
+    merged by id.
+
+    Returns:
+        The catalog rows, or None if nothing changed upstream
+    """
+    state = _xano_sync
+    now = time.time()
+    use_delta = bool(
+        XANO_UPDATED_SINCE_PARAM
+        and state["watermark"] is not None
+        and now - state["full_sync_at"] < CATALOG_FULL_SYNC_SECONDS
+    )
+
+    if use_delta:
+        raw_rows, _ = _xano_get(params={XANO_UPDATED_SINCE_PARAM: state["watermark"]})
+        if not raw_rows:
+            return None
+        rows = state["rows"]
+        changed = False
+        for raw in raw_rows:
+            key = _row_key(raw)
+            normalized = _normalize_catalog_row(raw)
+            if key is None or rows.get(key) == normalized:
+                continue
+            changed = True
+            if normalized:
+                rows[key] = normalized
+            else:
+                rows.pop(key, None)
+    else:
+        raw_rows, etag = _xano_get(etag=state["etag"])
+        state["full_sync_at"] = now
+        if raw_rows is None:
+            return None
+        rows = {}
+        for position, raw in enumerate(raw_rows):
+            normalized = _normalize_catalog_row(raw)
+            if normalized:
+                key = _row_key(raw)
+                rows.setdefault(("row", position) if key is None else key, normalized)
+        changed = rows != state["rows"]
+        state["rows"] = rows
+        state["etag"] = etag
+
+    updated = [raw.get("updated_at") for raw in raw_rows if isinstance(raw, dict)]
+    updated = [value for value in updated if isinstance(value, (int, float))]
+    if updated:
+        state["watermark"] = max(updated + ([state["watermark"]] if state["watermark"] is not None else []))
+    return list(rows.values()) if changed else None
 
 
 def fetch_colors_from_sqlite():
     ensure_database()
-    conn = get_connection()
-    rows = conn.execute(
-        """
-        SELECT code, name, extracted_hex
-        FROM pantone_colors
-        WHERE extracted_hex IS NOT NULL AND extracted_hex != ''
-        """
-    ).fetchall()
-    conn.close()
+    with db_pool.connection() as conn:
+        rows = conn.execute(SELECT_CATALOG).fetchall()
     colors = []
     for row in rows:
         normalized = _normalize_catalog_row(
@@ -195,100 +332,421 @@ def fetch_colors_from_sqlite():
     return colors
 
 
-def get_catalog_colors():
-    now = time.time()
-    if _catalog_cache["colors"] and now < _catalog_cache["expires_at"]:
-        return _catalog_cache["colors"], _catalog_cache["source"], None
+def load_colors_from_compiled():
+    """
+    Catalog rows and LabCatalog read from the compiled catalog, with the Lab
+    columns memory-mapped rather than recomputed.
 
-    if CATALOG_SOURCE == "sqlite":
-        colors = fetch_colors_from_sqlite()
-        source = "sqlite"
-        warn = None
-    else:
+    Returns:
+        (colors, catalog), or None if JSON_PATH cannot be compiled
+    """
+    compiled = load_compiled(JSON_PATH, COMPILED_CATALOG_PATH)
+    if compiled is None:
+        return None
+    L, a, b = compiled.lab_columns()
+    keep = np.flatnonzero(np.isfinite(L))
+    codes = compiled.strings("code").tolist()
+    names = compiled.strings("name").tolist()
+    hexes = compiled.strings("extracted_hex").tolist()
+    colors = [
+        {
+            "code": codes[i].strip() or "UNKNOWN",
+            "name": names[i].strip(),
+            "hex": normalize_hex(hexes[i]),
+            "swatch_url": None,
+        }
+        for i in keep
+    ]
+    if len(keep) != len(L):
+        L, a, b = L[keep], a[keep], b[keep]
+    catalog = LabCatalog.from_columns(
+        [row["code"] for row in colors], [row["name"] for row in colors], [row["hex"] for row in colors],
+        L, a, b, records=colors,
+    )
+    return colors, catalog
+
+
+def fetch_local_catalog():
+    """
+    (colors, catalog) from the SQLite database at DB_PATH when it exists,
+    else from the compiled catalog, else from a database built from JSON_PATH.
+    """
+    if not Path(DB_PATH).exists():
+        local = load_colors_from_compiled()
+        if local is not None:
+            return local
+    colors = fetch_colors_from_sqlite()
+    return colors, LabCatalog.from_rows(colors)
+
+
+def _retry_delay(failures):
+    delay = min(CATALOG_RETRY_MAX_SECONDS, CATALOG_RETRY_BASE_SECONDS * 2 ** max(0, failures - 1))
+    return delay * random.uniform(0.5, 1.5)
+
+
+def refresh_catalog():
+    """
+    Fetches the catalog and swaps it in; single-flight.
+
+    On failure the current catalog stays in place and the next attempt is
+    scheduled with jittered exponential backoff. Only the very first load
+    falls back to the local catalog (SQLite, else the compiled JSON) when
+    Xano is unavailable.
+
+    Returns:
+        False if another refresh was already running, else True
+    """
+    if not _refresh_lock.acquire(blocking=False):
+        return False
+    try:
+        with _catalog_lock:
+            has_catalog = _catalog_cache["catalog"] is not None
+            current_source = _catalog_cache["source"]
+        catalog = None
         try:
-            colors = fetch_colors_from_xano()
-            source = "xano"
-            warn = None
-        except (RuntimeError, urlerror.URLError, json.JSONDecodeError, TimeoutError) as exc:
-            # Safety fallback for local dev if Xano is unavailable.
-            colors = fetch_colors_from_sqlite()
-            source = "sqlite_fallback"
-            warn = f"Xano unavailable, using sqlite fallback: {exc}"
-
-    _catalog_cache["colors"] = colors
-    _catalog_cache["source"] = source
-    _catalog_cache["expires_at"] = now + max(1, CATALOG_CACHE_TTL_SECONDS)
-    return colors, source, warn
-
-
-def extract_dominant_hex_from_image(image_bytes: bytes, n_clusters: int = 3, fabric_mode: bool = False):
+            if CATALOG_SOURCE == "sqlite":
+                (colors, catalog), source, warn = fetch_local_catalog(), "sqlite", None
+            elif has_catalog and current_source == "xano":
+                # None: unchanged upstream, keep the current catalog as is
+                colors, source, warn = sync_colors_from_xano(), "xano", None
+            else:
+                _xano_sync.update(etag=None, watermark=None, rows={})
+                colors, source, warn = sync_colors_from_xano(), "xano", None
+                if colors is None:
+                    colors = list(_xano_sync["rows"].values())
+            error = None
+        except (RuntimeError, urlerror.URLError, json.JSONDecodeError, TimeoutError, OSError, sqlite3.Error) as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            if has_catalog or CATALOG_SOURCE == "sqlite":
+                colors = None
+            else:
+                # Safety fallback for local dev if Xano is unavailable.
+                try:
+                    colors, catalog = fetch_local_catalog()
+                    source = "sqlite_fallback"
+                    warn = f"Xano unavailable, using sqlite fallback: {exc}"
+                except Exception as fallback_exc:
+                    # Recorded with the Xano error below; retried with backoff
+                    colors = None
+                    error = f"{error}; local fallback failed: {type(fallback_exc).__name__}: {fallback_exc}"
+
+        if catalog is None and colors is not None:
+            catalog = LabCatalog.from_rows(colors)
+        now = time.time()
+        changed = False
+        with _catalog_lock:
+            if catalog is not None:
+                previous = _catalog_cache["catalog"]
+                changed = previous is None or previous.version != catalog.version
+                if changed:
+                    result_cache.clear()
+                _catalog_cache.update(
+                    colors=colors, catalog=catalog, source=source, warning=warn, loaded_at=now,
+                )
+            if error is None:
+                _catalog_cache["from_snapshot"] = False
+                _catalog_cache["failures"] = 0
+                _catalog_cache["checked_at"] = now
+                _catalog_cache["expires_at"] = now + max(1, CATALOG_CACHE_TTL_SECONDS)
+            else:
+                _catalog_cache["failures"] += 1
+                _catalog_cache["last_error"] = error
+                _catalog_cache["last_error_at"] = now
+                _catalog_cache["expires_at"] = now + _retry_delay(_catalog_cache["failures"])
+        if changed and source != "sqlite_fallback":
+            _save_catalog_snapshot(catalog, source)
+        return True
+    finally:
+        _refresh_lock.release()
+
+
+def _save_catalog_snapshot(catalog, source):
+    if not CATALOG_SNAPSHOT_PATH:
+        return
+    sync_state = None
+    if source == "xano":
+        sync_state = {
+            "etag": _xano_sync["etag"],
+            "watermark": _xano_sync["watermark"],
+            "full_sync_at": _xano_sync["full_sync_at"],
+            # Row ids, in catalog order (the rows themselves are the catalog)
+            "keys": list(_xano_sync["rows"]),
+        }
     try:
-        img = Image.open(BytesIO(image_bytes)).convert("RGB")
+        save_snapshot(CATALOG_SNAPSHOT_PATH, catalog, source, sync_state)
+    except (OSError, TypeError, ValueError) as exc:
+        print(f"Warning: could not save catalog snapshot: {exc}")
+
+
+def _restore_catalog_snapshot():
+    """
+    Loads the snapshot as the current catalog, due for an immediate refresh.
+
+    Returns:
+        True if a snapshot for the configured source was loaded
+    """
+    if not CATALOG_SNAPSHOT_PATH:
+        return False
+    snapshot = load_snapshot(CATALOG_SNAPSHOT_PATH)
+    if snapshot is None:
+        return False
+    catalog, colors, meta = snapshot
+    source = "sqlite" if CATALOG_SOURCE == "sqlite" else "xano"
+    if meta.get("source") != source:
+        return False
+
+    sync_state = meta.get("sync_state")
+    if source == "xano" and sync_state and len(sync_state.get("keys", [])) == len(colors):
+        _xano_sync.update(
+            etag=sync_state.get("etag"),
+            watermark=sync_state.get("watermark"),
+            full_sync_at=sync_state.get("full_sync_at") or 0.0,
+            # JSON turns tuple keys into lists
+            rows={
+                tuple(key) if isinstance(key, list) else key: row
+                for key, row in zip(sync_state["keys"], colors)
+            },
+        )
+    with _catalog_lock:
+        _catalog_cache.update(
+            colors=colors, catalog=catalog, source=source, warning=None,
+            loaded_at=meta.get("saved_at"), from_snapshot=True, expires_at=0.0,
+        )
+    return True
+
+
+def _catalog_refresher():
+    """Background loop: refreshes whenever the catalog (or a retry) is due."""
+    while True:
+        with _catalog_lock:
+            wait = _catalog_cache["expires_at"] - time.time()
+        if wait > 0:
+            time.sleep(wait)
+            continue
         try:
-            img = img.resize((100, 100), Image.Resampling.LANCZOS)
-        except AttributeError:
-            img = img.resize((100, 100), Image.LANCZOS)
+            refresh_catalog()
+        except Exception as exc:
+            # Never let the refresher die; retry with backoff.
+            with _catalog_lock:
+                _catalog_cache["failures"] += 1
+                _catalog_cache["last_error"] = f"{type(exc).__name__}: {exc}"
+                _catalog_cache["last_error_at"] = time.time()
+                _catalog_cache["expires_at"] = time.time() + _retry_delay(_catalog_cache["failures"])
+
+
+def _ensure_refresher():
+    with _catalog_lock:
+        if _refresher["thread"] is None:
+            _refresher["thread"] = threading.Thread(
+                target=_catalog_refresher, name="catalog-refresher", daemon=True,
+            )
+            _refresher["thread"].start()
+
+
+def _catalog_loaded():
+    with _catalog_lock:
+        return _catalog_cache["catalog"] is not None
+
+
+def _load_first_catalog():
+    """
+    Cold start: restores the snapshot, or runs the first fetch, or waits for
+    the one in flight and checks again.
+
+    Returns:
+        True once a catalog is loaded, False if the first fetch loaded none
+        (or failed recently and the background refresher owns the retry)
+    """
+    while True:
+        # Blocks while another thread restores or fetches
+        with _refresh_lock:
+            if _catalog_loaded() or _restore_catalog_snapshot():
+                return True
+        with _catalog_lock:
+            backing_off = _catalog_cache["failures"] and time.time() < _catalog_cache["expires_at"]
+        if backing_off:
+            return False
+        if refresh_catalog():
+            return _catalog_loaded()
+        # Another thread took _refresh_lock first: wait for it and re-check
 
-        pixels = np.array(img).reshape(-1, 3)
 
-        filtered_pixels = []
-        for pixel in pixels:
-            r, g, b = pixel
-            if r > 240 and g > 240 and b > 240:
-                continue
-            if r < 10 and g < 10 and b < 10:
-                continue
-            filtered_pixels.append(pixel)
+def get_catalog_colors():
+    """
+    The current catalog rows, stale-while-revalidate.
 
-        if not filtered_pixels:
-            filtered_pixels = pixels.tolist()
+    Only a cold start without a snapshot waits for a fetch; otherwise
+    requests always get the catalog in memory while the background thread
+    refreshes it.
 
-        filtered_pixels = np.array(filtered_pixels)
-        if len(filtered_pixels) == 0:
-            return None
+    Raises:
+        CatalogUnavailableError: Cold start and no source could be loaded
+    """
+    if not _catalog_loaded() and not _load_first_catalog():
+        _ensure_refresher()
+        raise CatalogUnavailableError("Catalog is not available yet, try again shortly.")
+    _ensure_refresher()
 
-        kmeans = KMeans(
-            n_clusters=min(max(1, n_clusters), len(filtered_pixels)),
-            random_state=42,
-            n_init=10,
-        )
-        kmeans.fit(filtered_pixels)
+    with _catalog_lock:
+        return _catalog_cache["colors"], _catalog_cache["source"], _catalog_cache["warning"]
+
+
+def catalog_status():
+    """
+    Age and refresh state of the in-memory catalog, for /api/health.
+
+    age_seconds counts from the last change of the catalog, checked_age_seconds
+    from the last successful check against the source.
+    """
+    now = time.time()
+    with _catalog_lock:
+        loaded_at = _catalog_cache["loaded_at"]
+        checked_at = _catalog_cache["checked_at"]
+        return {
+            "age_seconds": round(now - loaded_at, 1) if loaded_at else None,
+            "checked_age_seconds": round(now - checked_at, 1) if checked_at else None,
+            "from_snapshot": _catalog_cache["from_snapshot"],
+            "next_refresh_in_seconds": round(max(0.0, _catalog_cache["expires_at"] - now), 1),
+            "consecutive_failures": _catalog_cache["failures"],
+            "last_error": _catalog_cache["last_error"],
+            "last_error_age_seconds": (
+                round(now - _catalog_cache["last_error_at"], 1) if _catalog_cache["last_error_at"] else None
+            ),
+        }
+
+
+def get_lab_catalog():
+    get_catalog_colors()
+    with _catalog_lock:
+        return _catalog_cache["catalog"], _catalog_cache["source"], _catalog_cache["warning"]
+
+
+def _fabric_compensate(r, g, b):
+    """Darkens a photographed fabric color (Lab L -12%, a/b -2%) to the swatch it came from."""
+    from colormath.color_conversions import convert_color
+    from colormath.color_objects import LabColor, sRGBColor
+
+    rgb_norm = sRGBColor(r / 255.0, g / 255.0, b / 255.0)
+    lab = convert_color(rgb_norm, LabColor, target_illuminant="d65")
+    lab.lab_l = lab.lab_l * 0.88
+    lab.lab_a = lab.lab_a * 0.98
+    lab.lab_b = lab.lab_b * 0.98
+    rgb_adjusted = convert_color(lab, sRGBColor, target_illuminant="d65")
+    return (
+        int(np.clip(rgb_adjusted.rgb_r * 255, 0, 255)),
+        int(np.clip(rgb_adjusted.rgb_g * 255, 0, 255)),
+        int(np.clip(rgb_adjusted.rgb_b * 255, 0, 255)),
+    )
 
-        labels = kmeans.labels_
-        unique_labels, counts = np.unique(labels, return_counts=True)
-        dominant_cluster_idx = unique_labels[np.argmax(counts)]
-        dominant = kmeans.cluster_centers_[dominant_cluster_idx]
 
-        r = int(np.clip(dominant[0], 0, 255))
-        g = int(np.clip(dominant[1], 0, 255))
-        b = int(np.clip(dominant[2], 0, 255))
+def extract_dominant_hex_from_image(
+    image_bytes: Union[bytes, BinaryIO],
+    n_clusters: int = 3,
+    fabric_mode: bool = False,
+    white_threshold: int = WHITE_THRESHOLD,
+    black_threshold: int = BLACK_THRESHOLD,
+    extractor: str = DEFAULT_EXTRACTOR,
+    roi=None,
+    mask: Optional[bytes] = None,
+):
+    try:
+        pixels = extraction_pixels(image_bytes, roi=roi, mask=mask)
+
+        filtered_pixels = filter_background_pixels(
+            pixels, white_threshold=white_threshold, black_threshold=black_threshold
+        )
+        if len(filtered_pixels) == 0:
+            return None
+
+        r, g, b = dominant_rgb(filtered_pixels, n_clusters=n_clusters, extractor=extractor)
 
         if fabric_mode:
-            rgb_norm = sRGBColor(r / 255.0, g / 255.0, b / 255.0)
-            lab = convert_color(rgb_norm, LabColor, target_illuminant="d65")
-            lab.lab_l = lab.lab_l * 0.88
-            lab.lab_a = lab.lab_a * 0.98
-            lab.lab_b = lab.lab_b * 0.98
-            rgb_adjusted = convert_color(lab, sRGBColor, target_illuminant="d65")
-            r = int(np.clip(rgb_adjusted.rgb_r * 255, 0, 255))
-            g = int(np.clip(rgb_adjusted.rgb_g * 255, 0, 255))
-            b = int(np.clip(rgb_adjusted.rgb_b * 255, 0, 255))
+            r, g, b = _fabric_compensate(r, g, b)
 
         return f"#{r:02x}{g:02x}{b:02x}"
     except Exception:
         return None
 
 
-def compute_matches_from_input_lab(input_lab: Lab, limit: int):
-    rows, source, warning = get_catalog_colors()
+def extract_palette_from_image(
+    image_bytes: Union[bytes, BinaryIO],
+    n_clusters: int = 3,
+    fabric_mode: bool = False,
+    white_threshold: int = WHITE_THRESHOLD,
+    black_threshold: int = BLACK_THRESHOLD,
+    extractor: str = DEFAULT_EXTRACTOR,
+    roi=None,
+    mask: Optional[bytes] = None,
+):
+    """
+    Every color cluster of the image (or of its roi / mask region, see
+    image_pipeline.region_pixels), most populated first.
+
+    Returns:
+        List of {"hex": "rrggbb", "pixels": count, "share": fraction of the
+        non-background pixels}, or None if nothing could be extracted
+    """
+    try:
+        pixels = extraction_pixels(image_bytes, roi=roi, mask=mask)
+
+        filtered_pixels = filter_background_pixels(
+            pixels, white_threshold=white_threshold, black_threshold=black_threshold
+        )
+        if len(filtered_pixels) == 0:
+            return None
+
+        centers, counts = cluster_pixels(filtered_pixels, n_clusters=n_clusters, extractor=extractor)
+        total = int(counts.sum())
+        palette = []
+        for index in np.argsort(-counts, kind="stable"):
+            if counts[index] == 0:
+                continue
+            r, g, b = (int(np.clip(channel, 0, 255)) for channel in centers[index])
+            if fabric_mode:
+                r, g, b = _fabric_compensate(r, g, b)
+            palette.append(
+                {
+                    "hex": f"{r:02x}{g:02x}{b:02x}",
+                    "pixels": int(counts[index]),
+                    "share": round(int(counts[index]) / total, 4),
+                }
+            )
+        return palette
+    except Exception:
+        return None
+
+
+def parse_fields(value):
+    """
+    Result fields requested with fields= ("code,hex,delta_e" or a list).
+
+    Returns:
+        List of MATCH_FIELDS names, or None for all fields
 
+    Raises:
+        ValueError: A name is not in MATCH_FIELDS
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    fields = [str(field).strip() for field in value if str(field).strip()]
+    unknown = [field for field in fields if field not in MATCH_FIELDS and field not in MATCH_FIELD_ALIASES]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(MATCH_FIELDS)}.")
+    return fields or None
+
+
+def project_matches(matches, fields):
+    if fields is None:
+        return matches
+    return [{field: match[MATCH_FIELD_ALIASES.get(field, field)] for field in fields} for match in matches]
+
+
+def _build_matches(catalog, indices, distances):
     matches = []
-    for row in rows:
-        try:
-            row_lab = hex_to_lab(row["hex"])
-        except ValueError:
-            continue
-        distance = delta_e_cie2000_from_lab(input_lab, row_lab)
+    for index, distance in zip(indices.tolist(), distances.tolist()):
+        row = catalog.records[index]
         similarity = max(0.0, 100.0 - (distance * 5.0))
         matches.append(
             {
@@ -300,23 +758,49 @@ def compute_matches_from_input_lab(input_lab: Lab, limit: int):
                 "similarity": round(similarity, 2),
             }
         )
+    return matches
+
+
+def compute_matches_from_input_lab(input_lab: Lab, limit: int):
+    catalog, source, warning = get_lab_catalog()
+    if not len(catalog):
+        return [], 0, source, warning
+
+    indices, distances = catalog.top_k((input_lab.l, input_lab.a, input_lab.b), limit)
+    return _build_matches(catalog, indices, distances), len(catalog), source, warning
 
-    matches.sort(key=lambda x: x["delta_e"])
-    return matches[:limit], len(matches), source, warning
+
+def compute_matches_batch(input_labs, limits):
+    catalog, source, warning = get_lab_catalog()
+    if not len(catalog):
+        return [[] for _ in limits], 0, source, warning
+
+    top = catalog.top_k_batch(input_labs, limits)
+    matches = [_build_matches(catalog, indices, distances) for indices, distances in top]
+    return matches, len(catalog), source, warning
 
 
 @app.get("/api/health")
 def health():
-    colors, source, warning = get_catalog_colors()
+    try:
+        colors, source, warning = get_catalog_colors()
+        status = 200
+    except CatalogUnavailableError as exc:
+        colors, source, warning, status = [], None, str(exc), 503
     return jsonify(
         {
-            "ok": True,
+            "ok": status == 200,
             "catalog_source": source,
             "catalog_rows": len(colors),
             "xano_base_url": XANO_BASE_URL or None,
             "warning": warning,
+            "image_pool": image_pool.stats(),
+            "extraction_cache": extraction_cache.stats(),
+            "result_cache": result_cache.stats(),
+            "sqlite_pool": db_pool.stats(),
+            "catalog_refresh": catalog_status(),
         }
-    )
+    ), status
 
 
 @app.route("/api/match", methods=["POST", "OPTIONS"])
@@ -335,10 +819,18 @@ def match_hex():
     try:
         normalized = normalize_hex(hex_input)
         input_lab = hex_to_lab(normalized)
+        fields = parse_fields(payload.get("fields") or request.args.get("fields"))
     except ValueError as exc:
         return jsonify({"error": str(exc)}), 400
 
-    top, total_compared, source, warning = compute_matches_from_input_lab(input_lab, limit)
+    catalog, source, warning = get_lab_catalog()
+    result_key = (normalized, limit, "extracted_hex", 1.0, catalog.version)
+    cached = result_cache.get(result_key)
+    if cached is None:
+        top, total_compared, source, warning = compute_matches_from_input_lab(input_lab, limit)
+        result_cache.put(result_key, (top, total_compared))
+    else:
+        top, total_compared = cached
     return jsonify(
         {
             "input_hex": f"#{normalized}",
@@ -346,61 +838,247 @@ def match_hex():
             "catalog_source": source,
             "warning": warning,
             "total_compared": total_compared,
-            "results": top,
+            "results": project_matches(top, fields),
         }
     )
 
 
-@app.route("/api/match-image", methods=["POST", "OPTIONS"])
-def match_image():
+@app.route("/api/match/batch", methods=["POST", "OPTIONS"])
+def match_hex_batch():
     if request.method == "OPTIONS":
         return make_response("", 204)
 
-    if "image" not in request.files:
-        return jsonify({"error": "Image file is required (field: image)."}), 400
+    payload = request.get_json(silent=True) or {}
+    items = payload.get("items")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items must be a non-empty list"}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({"error": f"At most {MAX_BATCH_ITEMS} items per batch."}), 400
+
+    default_limit = payload.get("limit", 5)
+    default_boost = payload.get("lightness_boost", 1.0)
+    try:
+        fields = parse_fields(payload.get("fields") or request.args.get("fields"))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    entries = []
+    for item in items:
+        if not isinstance(item, dict):
+            item = {"hex": item}
+        entry = {"input": item.get("hex")}
+        entries.append(entry)
+        try:
+            entry["hex"] = normalize_hex(str(item.get("hex") or ""))
+        except ValueError as exc:
+            entry["error"] = str(exc)
+            continue
+        try:
+            entry["limit"] = max(1, min(int(item.get("limit", default_limit)), 20))
+        except (TypeError, ValueError):
+            entry["error"] = "Invalid limit."
+            continue
+        try:
+            boost = float(item.get("lightness_boost", default_boost))
+        except (TypeError, ValueError):
+            boost = None
+        if boost is None or not np.isfinite(boost):
+            entry["error"] = "Invalid lightness_boost."
+            continue
+        entry["lightness_boost"] = boost
+
+    valid = [entry for entry in entries if "error" not in entry]
+    matches, total_compared, source, warning = [], 0, None, None
+    if valid:
+        input_labs = hex_to_lab_array([entry["hex"] for entry in valid])
+        for lab, entry in zip(input_labs, valid):
+            if entry["lightness_boost"] != 1.0:
+                lab[0] = min(100.0, lab[0] * entry["lightness_boost"])
+        matches, total_compared, source, warning = compute_matches_batch(
+            input_labs, [entry["limit"] for entry in valid]
+        )
+    for entry, top in zip(valid, matches):
+        entry["results"] = top
+
+    results = []
+    for entry in entries:
+        if "error" in entry:
+            results.append({"input_hex": entry["input"], "error": entry["error"], "results": []})
+        else:
+            results.append(
+                {
+                    "input_hex": f"#{entry['hex']}",
+                    "limit": entry["limit"],
+                    "lightness_boost": entry["lightness_boost"],
+                    "results": project_matches(entry["results"], fields),
+                }
+            )
+
+    return jsonify(
+        {
+            "metric": "cie2000",
+            "catalog_source": source,
+            "warning": warning,
+            "total_compared": total_compared,
+            "count": len(results),
+            "results": results,
+        }
+    )
 
-    image_file = request.files["image"]
-    if not image_file or image_file.filename == "":
-        return jsonify({"error": "Image file is empty."}), 400
 
+def _image_params(form):
+    """
+    Extraction and matching parameters of the image endpoints.
+
+    Returns:
+        (params, None), or (None, error message) for an invalid value
+    """
     try:
-        limit = int(request.form.get("limit", 5))
-        limit = max(1, min(limit, 20))
+        limit = max(1, min(int(form.get("limit", 5)), 20))
     except ValueError:
-        return jsonify({"error": "Invalid limit."}), 400
+        return None, "Invalid limit."
 
     try:
-        n_clusters = int(request.form.get("n_clusters", 3))
-        n_clusters = max(1, min(n_clusters, 8))
+        n_clusters = max(1, min(int(form.get("n_clusters", 3)), 8))
     except ValueError:
-        return jsonify({"error": "Invalid n_clusters."}), 400
+        return None, "Invalid n_clusters."
 
     try:
-        lightness_boost = float(request.form.get("lightness_boost", 1.05))
+        lightness_boost = float(form.get("lightness_boost", 1.05))
     except ValueError:
-        return jsonify({"error": "Invalid lightness_boost."}), 400
+        return None, "Invalid lightness_boost."
 
-    fabric_mode = str(request.form.get("fabric_mode", "true")).lower() == "true"
+    try:
+        white_threshold = max(0, min(int(form.get("white_threshold", WHITE_THRESHOLD)), 255))
+        black_threshold = max(0, min(int(form.get("black_threshold", BLACK_THRESHOLD)), 255))
+    except ValueError:
+        return None, "Invalid white_threshold/black_threshold."
+
+    extractor = str(form.get("extractor", DEFAULT_EXTRACTOR)).strip().lower()
+    if extractor not in EXTRACTORS:
+        return None, f"Invalid extractor. Use one of: {', '.join(EXTRACTORS)}."
+
+    try:
+        fields = parse_fields(form.get("fields") or request.args.get("fields"))
+    except ValueError as exc:
+        return None, str(exc)
 
-    image_bytes = image_file.read()
-    extracted_hex = extract_dominant_hex_from_image(
-        image_bytes=image_bytes,
-        n_clusters=n_clusters,
-        fabric_mode=fabric_mode,
+    try:
+        roi = parse_roi(form.get("roi"))
+    except ValueError as exc:
+        return None, f"Invalid roi: {exc}"
+
+    return {
+        "limit": limit,
+        "n_clusters": n_clusters,
+        "fabric_mode": str(form.get("fabric_mode", "true")).lower() == "true",
+        "lightness_boost": lightness_boost,
+        "white_threshold": white_threshold,
+        "black_threshold": black_threshold,
+        "extractor": extractor,
+        "fields": fields,
+        "roi": roi,
+    }, None
+
+
+def _run_extraction(func, image_file, params):
+    """
+    Runs an extraction function on the upload (in the image pool, if any),
+    restricted to the roi and the optional `mask` upload. Results are cached
+    by upload content and parameters (extraction_cache).
+
+    Returns:
+        (result, None), or (None, error response) when the pool is saturated
+        or timed out
+    """
+    # Inline extraction reads the upload stream in place; worker processes
+    # need the bytes.
+    image_source = image_file.read() if image_pool.workers else image_file.stream
+    mask_file = request.files.get("mask")
+    mask = mask_file.read() if mask_file and mask_file.filename else None
+    extract_params = {
+        key: params[key]
+        for key in ("n_clusters", "fabric_mode", "white_threshold", "black_threshold", "extractor", "roi")
+    }
+    key = cache_key(
+        func.__name__,
+        upload_digest(image_source),
+        mask=upload_digest(mask) if mask is not None else None,
+        **extract_params,
     )
+    result = extraction_cache.get(key)
+    if result is not None:
+        return result, None
+
+    try:
+        result = image_pool.run(func, image_bytes=image_source, mask=mask, **extract_params)
+    except PoolSaturatedError as exc:
+        response = jsonify({"error": str(exc)})
+        response.headers["Retry-After"] = "1"
+        return None, (response, 503)
+    except ExtractionTimeoutError as exc:
+        return None, (jsonify({"error": str(exc)}), 504)
+    extraction_cache.put(key, result)
+    return result, None
+
+
+def _uploaded_image():
+    """(file, None), or (None, error response) if the image field is missing or empty."""
+    if "image" not in request.files:
+        return None, (jsonify({"error": "Image file is required (field: image)."}), 400)
+    image_file = request.files["image"]
+    if not image_file or image_file.filename == "":
+        return None, (jsonify({"error": "Image file is empty."}), 400)
+    return image_file, None
+
+
+def _region_name(params):
+    if params["roi"] is not None or request.files.get("mask"):
+        return "the selected region (check the roi / mask)"
+    return "image"
+
+
+def _params_payload(params):
+    payload = {
+        key: params[key]
+        for key in ("n_clusters", "fabric_mode", "lightness_boost", "white_threshold", "black_threshold", "extractor")
+    }
+    if params["roi"] is not None:
+        kind, coords = params["roi"]
+        payload["roi"] = {"type": kind, "coords": coords}
+    if request.files.get("mask"):
+        payload["mask"] = True
+    return payload
+
+
+@app.route("/api/match-image", methods=["POST", "OPTIONS"])
+def match_image():
+    if request.method == "OPTIONS":
+        return make_response("", 204)
+
+    image_file, error = _uploaded_image()
+    if error:
+        return error
+    params, message = _image_params(request.form)
+    if message:
+        return jsonify({"error": message}), 400
+
+    extracted_hex, error = _run_extraction(extract_dominant_hex_from_image, image_file, params)
+    if error:
+        return error
     if not extracted_hex:
-        return jsonify({"error": "Could not extract dominant color from image."}), 400
+        return jsonify({"error": f"Could not extract dominant color from {_region_name(params)}."}), 400
 
     normalized = normalize_hex(extracted_hex)
     input_lab = hex_to_lab(normalized)
-    if lightness_boost != 1.0:
+    if params["lightness_boost"] != 1.0:
         input_lab = Lab(
-            l=min(100.0, input_lab.l * lightness_boost),
+            l=min(100.0, input_lab.l * params["lightness_boost"]),
             a=input_lab.a,
             b=input_lab.b,
         )
 
-    top, total_compared, source, warning = compute_matches_from_input_lab(input_lab, limit)
+    top, total_compared, source, warning = compute_matches_from_input_lab(input_lab, params["limit"])
     return jsonify(
         {
             "input_hex": f"#{normalized}",
@@ -410,12 +1088,59 @@ def match_image():
             "catalog_source": source,
             "warning": warning,
             "total_compared": total_compared,
-            "params": {
-                "n_clusters": n_clusters,
-                "fabric_mode": fabric_mode,
-                "lightness_boost": lightness_boost,
-            },
-            "results": top,
+            "params": _params_payload(params),
+            "results": project_matches(top, params["fields"]),
+        }
+    )
+
+
+@app.route("/api/match-palette", methods=["POST", "OPTIONS"])
+def match_palette():
+    """
+    Every cluster of the image (n_clusters, most populated first) with its
+    pixel share and top `limit` matches; all centroids are scored against
+    the catalog in one batched pass.
+    """
+    if request.method == "OPTIONS":
+        return make_response("", 204)
+
+    image_file, error = _uploaded_image()
+    if error:
+        return error
+    params, message = _image_params(request.form)
+    if message:
+        return jsonify({"error": message}), 400
+
+    palette, error = _run_extraction(extract_palette_from_image, image_file, params)
+    if error:
+        return error
+    if not palette:
+        return jsonify({"error": f"Could not extract colors from {_region_name(params)}."}), 400
+
+    input_labs = hex_to_lab_array([color["hex"] for color in palette])
+    if params["lightness_boost"] != 1.0:
+        input_labs[:, 0] = np.minimum(100.0, input_labs[:, 0] * params["lightness_boost"])
+    matches, total_compared, source, warning = compute_matches_batch(
+        input_labs, [params["limit"]] * len(palette)
+    )
+
+    return jsonify(
+        {
+            "metric": "cie2000",
+            "mode": "palette",
+            "catalog_source": source,
+            "warning": warning,
+            "total_compared": total_compared,
+            "params": _params_payload(params),
+            "palette": [
+                {
+                    "hex": f"#{color['hex']}",
+                    "pixels": color["pixels"],
+                    "share": color["share"],
+                    "results": project_matches(top, params["fields"]),
+                }
+                for color, top in zip(palette, matches)
+            ],
         }
     )
 
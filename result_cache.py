@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Bounded, thread-safe LRU cache for match results.
+
+Callers key entries on the normalized query parameters plus the catalog
+version, so a catalog refresh can never serve stale rankings; the owners
+also clear the cache when the catalog version changes.
+
+With `ttl` (seconds), entries also expire that long after being stored.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAXSIZE = int(os.environ.get("SMARTCOLOR_RESULT_CACHE_SIZE", "4096"))
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Least-recently-used cache with hit / miss / eviction counters."""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=None):
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._expires = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is not _MISSING and self.ttl is not None and self._expires[key] <= time.monotonic():
+                del self._data[key], self._expires[key]
+                value = _MISSING
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.ttl is not None:
+                self._expires[key] = time.monotonic() + self.ttl
+            while len(self._data) > self.maxsize:
+                evicted, _ = self._data.popitem(last=False)
+                self._expires.pop(evicted, None)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
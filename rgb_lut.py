@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Precomputed RGB -> nearest catalog colors lookup table.
+
+Inputs are 8-bit sRGB, so there are only 2^24 distinct HEX queries. The
+offline builder stores, for every RGB triple, the top-k catalog entries by
+CIEDE2000 (indices into the LabCatalog plus their Delta E) in a .npy file
+that is memory-mapped at load time. ColorMatcher answers lightness_boost ==
+1.0 queries with limit <= k from it with one array read and no distance
+math.
+
+Each table has a JSON sidecar with the catalog's `lab_version`; a table
+built for a different catalog (e.g. after pantone_data.json changed and the
+database was rebuilt) is ignored, with a warning and "stale" in
+ColorMatcher.lut_status (/api/health), until it is rebuilt by hand:
+
+    python rgb_lut.py --column all --k 5 --workers 8
+
+The build scores every RGB value exactly and is CPU-bound (on the order of
+a core-hour per 1,000 catalog colors); it is an offline step, and tables
+that are already current are skipped. Each table is 2^24 rows of k indices
+plus k float32 distances (500 MB for k=5 with a uint16 index).
+
+Rankings are the same as LabCatalog.top_k (distance, then code). Delta E
+is stored as float32, so a displayed value can differ in the last rounded
+digit in rare half-way cases.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from catalog import rank_rows, safe_radius
+from color_engine import delta_e_cie2000_components, srgb_to_lab
+
+RGB_LUT_DIR = os.environ.get('SMARTCOLOR_RGB_LUT_DIR', 'rgb_lut')
+FORMAT_VERSION = 2
+DEFAULT_K = 5
+
+# Side of the RGB cube blocks scored together. Neighbouring colors share
+# most of their candidates, so one pruned candidate set serves the block.
+_BLOCK_SIDE = 16
+
+
+def lut_paths(directory, hex_column):
+    """(table .npy path, metadata .json path) for one HEX column."""
+    base = os.path.join(directory, f'{hex_column}_rgb_lut')
+    return base + '.npy', base + '.json'
+
+
+def lut_dtype(k, catalog_size):
+    index_type = '<u2' if catalog_size <= np.iinfo(np.uint16).max else '<u4'
+    return np.dtype([('index', index_type, (k,)), ('delta_e', '<f4', (k,))])
+
+
+def _fill_reds(table_path, reds, lab, code_rank, k):
+    """
+    Fills the table rows for the given red values (runs in a worker).
+
+    Each 1 x 16 x 16 block of RGB values is pruned like LabCatalog's index:
+    the nearest entries by Delta E 76 give an upper bound for every query's
+    k-th best CIEDE2000, safe_radius turns it into a Delta E 76 radius, and
+    only entries within some query's radius are scored exactly.
+    """
+    table = np.load(table_path, mmap_mode='r+')
+    L, a, b = lab
+    max_chroma = float(np.hypot(a, b).max())
+    max_lightness_span = float(np.abs(L - 50.0).max())
+    seed_count = min(len(L), max(4 * k, 16))
+
+    side = np.arange(_BLOCK_SIDE)
+    green, blue = (axis.ravel() for axis in np.meshgrid(side, side, indexing='ij'))
+    for red in reds:
+        for g_start in range(0, 256, _BLOCK_SIDE):
+            for b_start in range(0, 256, _BLOCK_SIDE):
+                rgb = np.column_stack((np.full(len(green), red), g_start + green, b_start + blue))
+                query = srgb_to_lab(rgb / 255.0)
+                ql, qa, qb = query[:, 0:1], query[:, 1:2], query[:, 2:3]
+
+                # Squared Delta E 76 to every entry, then exact scores for the
+                # nearest few per query as the k-th best upper bound
+                d76 = (ql - L) ** 2 + (qa - a) ** 2 + (qb - b) ** 2
+                seed = np.argpartition(d76, seed_count - 1, axis=1)[:, :seed_count]
+                seed_scores = delta_e_cie2000_components(ql, qa, qb, L[seed], a[seed], b[seed])
+                kth_best = np.partition(seed_scores, k - 1, axis=1)[:, k - 1]
+
+                radius = safe_radius(ql[:, 0], qa[:, 0], qb[:, 0], kth_best, max_chroma, max_lightness_span)
+                candidates = np.flatnonzero((d76 <= (radius ** 2)[:, None]).any(axis=0))
+                distances = delta_e_cie2000_components(
+                    ql, qa, qb, L[candidates], a[candidates], b[candidates],
+                )
+                indices, values = rank_rows(distances, k, code_rank[candidates])
+
+                rows = (red << 16) | ((g_start + green) << 8) | (b_start + blue)
+                table['index'][rows] = candidates[indices]
+                table['delta_e'][rows] = values
+        table.flush()
+    return len(reds)
+
+
+def build_lut(catalog, hex_column, directory=RGB_LUT_DIR, k=DEFAULT_K, workers=1, verbose=True):
+    """
+    Builds the table for one catalog and writes it atomically.
+
+    Args:
+        catalog: LabCatalog the indices refer to
+        hex_column: Name stored in the file name and metadata
+        directory: Output directory
+        k: Entries stored per RGB value (queries with a larger limit fall back)
+        workers: Processes to split the red channel across
+
+    Returns:
+        Path of the .npy table
+    """
+    k = max(1, min(int(k), len(catalog)))
+    os.makedirs(directory, exist_ok=True)
+    table_path, meta_path = lut_paths(directory, hex_column)
+    tmp_path = table_path + '.tmp.npy'
+
+    table = np.lib.format.open_memmap(
+        tmp_path, mode='w+', dtype=lut_dtype(k, len(catalog)), shape=(1 << 24,),
+    )
+    del table
+
+    lab = (catalog.L, catalog.a, catalog.b)
+    started = time.time()
+    chunks = [[red] for red in range(256)]
+    done = 0
+    if workers > 1:
+        with multiprocessing.get_context('spawn').Pool(workers) as pool:
+            jobs = [pool.apply_async(_fill_reds, (tmp_path, reds, lab, catalog.code_rank, k)) for reds in chunks]
+            for job in jobs:
+                done += job.get()
+                if verbose:
+                    print(f"  {hex_column}: {done}/256 red values ({time.time() - started:.0f}s)")
+    else:
+        for reds in chunks:
+            done += _fill_reds(tmp_path, reds, lab, catalog.code_rank, k)
+            if verbose:
+                print(f"  {hex_column}: {done}/256 red values ({time.time() - started:.0f}s)")
+
+    # The old metadata goes first, so a reader never pairs it with the new table
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    os.replace(tmp_path, table_path)
+    with open(meta_path + '.tmp', 'w', encoding='utf-8') as fh:
+        json.dump({
+            'format_version': FORMAT_VERSION,
+            'hex_column': hex_column,
+            'k': k,
+            'catalog_rows': len(catalog),
+            'catalog_version': catalog.lab_version,
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        }, fh, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+    return table_path
+
+
+def read_metadata(directory, hex_column):
+    _, meta_path = lut_paths(directory, hex_column)
+    try:
+        with open(meta_path, encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def is_current(meta, catalog):
+    """True if the metadata describes a table built for this catalog."""
+    return bool(
+        meta
+        and meta.get('format_version') == FORMAT_VERSION
+        and meta.get('catalog_version') == catalog.lab_version
+        and meta.get('catalog_rows') == len(catalog)
+    )
+
+
+def lut_status(catalog, hex_column, directory=RGB_LUT_DIR):
+    """'current', 'stale' (built for another catalog or format) or 'missing'."""
+    meta = read_metadata(directory, hex_column)
+    if meta is None:
+        return 'missing'
+    return 'current' if is_current(meta, catalog) else 'stale'
+
+
+class RGBLookupTable:
+    """Memory-mapped RGB -> top-k table for one catalog."""
+
+    def __init__(self, table, meta):
+        self.table = table
+        self.meta = meta
+        self.k = int(meta['k'])
+
+    @classmethod
+    def load(cls, catalog, hex_column, directory=RGB_LUT_DIR):
+        """The table for this catalog, or None if missing or built for another catalog."""
+        meta = read_metadata(directory, hex_column)
+        if meta is None:
+            return None
+        if not is_current(meta, catalog):
+            print(f"Warning: {hex_column} RGB lookup table is stale (built for another catalog), "
+                  f"matching without it; rebuild with: python rgb_lut.py --column {hex_column}")
+            return None
+        table_path, _ = lut_paths(directory, hex_column)
+        try:
+            table = np.load(table_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if table.shape != (1 << 24,):
+            return None
+        return cls(table, meta)
+
+    def lookup(self, hex_value, limit):
+        """
+        (indices, distances) of the `limit` nearest entries for a HEX color,
+        or None if limit is outside 0..k.
+        """
+        if not 0 <= limit <= self.k:
+            return None
+        row = self.table[int(hex_value.strip().lstrip('#'), 16)]
+        return row['index'][:limit].astype(np.intp), row['delta_e'][:limit].astype(np.float64)
+
+
+def main():
+    from color_matcher import ColorMatcher, HEX_COLUMNS
+
+    parser = argparse.ArgumentParser(description='Build the RGB -> Pantone lookup tables')
+    parser.add_argument('--column', default='all', choices=('all',) + HEX_COLUMNS,
+                        help='HEX column to build (default: all)')
+    parser.add_argument('--k', type=int, default=DEFAULT_K, help='Matches stored per RGB value')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--dir', default=RGB_LUT_DIR, help='Output directory')
+    parser.add_argument('--force', action='store_true', help='Rebuild even if the table is current')
+    args = parser.parse_args()
+
+    matcher = ColorMatcher()
+    columns = HEX_COLUMNS if args.column == 'all' else (args.column,)
+    for column in columns:
+        catalog = matcher.catalogs[column]
+        if not len(catalog):
+            print(f"{column}: empty catalog, skipped")
+            continue
+        meta = read_metadata(args.dir, column)
+        if not args.force and is_current(meta, catalog) and meta.get('k', 0) >= args.k:
+            print(f"{column}: up to date ({meta['catalog_version']})")
+            continue
+        print(f"{column}: building for {len(catalog)} colors, k={args.k}")
+        path = build_lut(catalog, column, directory=args.dir, k=args.k, workers=args.workers)
+        print(f"{column}: wrote {path}")
+
+
+if __name__ == '__main__':
+    main()
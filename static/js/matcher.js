@@ -363,7 +363,7 @@ function displayResults(data) {
         
         // Image or placeholder
         const imageHtml = result.image_url 
-            ? `<img src="${result.image_url}" alt="${result.code}" class="result-image" onclick="window.open('${result.image_url}', '_blank')">`
+            ? `<img src="${result.image_url}&w=256" srcset="${result.image_url}&w=256 1x, ${result.image_url}&w=512 2x" alt="${result.code}" class="result-image" onclick="window.open('${result.image_url}', '_blank')">`
             : `<div style="width: 100%; height: 200px; background: #f0f0f0; border-radius: 10px; display: flex; align-items: center; justify-content: center; color: #999;">Image not available</div>`;
         
         // Formata LAB
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Serving helpers for the swatch images behind /api/image/<code>.
+
+Every image gets a strong ETag (SHA-256 of its content) and its real
+content type (sniffed from the file signature). Both are memoized per file
+and recomputed only when the file's size or mtime changes, so a repeat
+request costs one os.stat.
+
+Image URLs carry `?v=<version>`, a fingerprint of the file's stat, making
+them content-addressed: a request whose version matches is served with a
+one-year immutable Cache-Control, any other with a short max-age and the
+validators for a 304.
+
+`?w=<width>` serves a thumbnail instead, at one of THUMB_WIDTHS (the
+requested width is rounded up to the next one), as WebP when the client
+accepts it and JPEG otherwise. Thumbnails are generated once and stored
+under THUMB_DIR keyed by the source content hash, width and format, so an
+edited source gets new thumbnails and stale ones are simply never read.
+
+Configuration (environment):
+    SMARTCOLOR_IMAGE_MAX_AGE          max-age of versioned URLs (default: 1 year)
+    SMARTCOLOR_IMAGE_REVALIDATE_AGE   max-age of unversioned URLs (default: 1 hour)
+    SMARTCOLOR_THUMB_DIR              thumbnail cache directory (default: ./thumb_cache)
+"""
+
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+
+IMMUTABLE_MAX_AGE = int(os.environ.get("SMARTCOLOR_IMAGE_MAX_AGE", str(365 * 24 * 3600)))
+REVALIDATE_MAX_AGE = int(os.environ.get("SMARTCOLOR_IMAGE_REVALIDATE_AGE", "3600"))
+
+# Absolute: Flask's send_file resolves relative paths against the app root,
+# not the working directory the cache was written under
+THUMB_DIR = os.path.abspath(os.environ.get("SMARTCOLOR_THUMB_DIR", "thumb_cache"))
+THUMB_WIDTHS = (64, 128, 256, 512)
+THUMB_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}),
+}
+
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+_info_lock = threading.Lock()
+_info = {}
+
+
+def _stat_key(stat):
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def image_version(path):
+    """Short fingerprint of the file's inode, size and mtime, for `?v=` in URLs."""
+    stat = os.stat(path)
+    return hashlib.sha1(repr(_stat_key(stat)).encode("ascii")).hexdigest()[:12]
+
+
+def sniff_mimetype(header, path=None):
+    """Content type from the first bytes of an image file."""
+    for signature, mimetype in _SIGNATURES:
+        if header.startswith(signature):
+            return mimetype
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    guessed = mimetypes.guess_type(path)[0] if path else None
+    return guessed or "application/octet-stream"
+
+
+def image_info(path):
+    """
+    ETag, content type and stat of an image file.
+
+    Returns:
+        dict with etag (content SHA-256, hex), mimetype, version, size and
+        mtime (seconds)
+
+    Raises:
+        OSError: The file does not exist or cannot be read
+    """
+    stat = os.stat(path)
+    key = _stat_key(stat)
+    with _info_lock:
+        cached = _info.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        header = fh.read(16)
+        digest.update(header)
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+
+    info = {
+        "etag": digest.hexdigest(),
+        "mimetype": sniff_mimetype(header, path),
+        "version": image_version(path),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+    }
+    with _info_lock:
+        _info[path] = (key, info)
+    return info
+
+
+def cache_control(requested_version, info):
+    """Cache-Control value for a request of `?v=requested_version`."""
+    if requested_version and requested_version == info["version"]:
+        return f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    return f"public, max-age={REVALIDATE_MAX_AGE}"
+
+
+def thumbnail_width(requested):
+    """The smallest THUMB_WIDTHS entry >= requested (the largest if none is)."""
+    for width in THUMB_WIDTHS:
+        if requested <= width:
+            return width
+    return THUMB_WIDTHS[-1]
+
+
+def _render_thumbnail(source_path, width, fmt, target_path):
+    from PIL import Image
+
+    pil_format, _, options = THUMB_FORMATS[fmt]
+    with Image.open(source_path) as img:
+        if img.format == "JPEG":
+            # libjpeg scales by 1/2..1/8 while decoding
+            img.draft("RGB", (width, width))
+        img = img.convert("RGB")
+    img.thumbnail((width, width * 4), getattr(Image, "Resampling", Image).LANCZOS, reducing_gap=2.0)
+
+    directory = os.path.dirname(target_path)
+    os.makedirs(directory, exist_ok=True)
+    # Written under a temporary name and renamed, so concurrent requests
+    # never read a half-written file
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            img.save(fh, format=pil_format, **options)
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def thumbnail(source_path, info, width, fmt="jpeg"):
+    """
+    Path and serving info of a cached thumbnail, rendering it on first use.
+
+    Args:
+        source_path: Full-size image
+        info: image_info(source_path)
+        width: Requested width in pixels (rounded up to THUMB_WIDTHS)
+        fmt: Key of THUMB_FORMATS
+
+    Returns:
+        (path, dict with etag and mimetype)
+    """
+    width = thumbnail_width(width)
+    _, mimetype, _ = THUMB_FORMATS[fmt]
+    key = f"{info['etag']}-w{width}"
+    path = os.path.join(THUMB_DIR, info["etag"][:2], f"{key}.{fmt}")
+    if not os.path.exists(path):
+        _render_thumbnail(source_path, width, fmt, path)
+    return path, {"etag": f"{key}-{fmt}", "mimetype": mimetype}